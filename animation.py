@@ -0,0 +1,149 @@
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+# Client-side Play mode for the quickdash apps.
+# Every frame of an animation (Top-N and start year fixed, end year stepping to the last year) is computed once in
+# a background thread, when Play is pressed or ahead of it with PREBUILD_ANIMATION in the apps, and sent to the
+# browser as one figure with Plotly animation frames, so playback needs no server round trip per tick. Frames are delta-encoded against the first figure: attributes that are the same in
+# every frame (styles, colorbars, ...) are only sent once, and each frame only carries the ones that change.
+
+FRAME_DURATION = 500  # ms per frame
+TRANSITION_DURATION = 300
+MAX_ANIMATIONS = 16  # built animations kept in memory
+
+
+def changed_keys(base, figure):
+    # nested dict of the attributes where figure differs from base
+    changed = {}
+    for key, value in figure.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            nested = changed_keys(base[key], value)
+            if nested:
+                changed[key] = nested
+        elif base.get(key) != value:
+            changed[key] = True
+    return changed
+
+
+def merge_keys(keys, other):
+    for key, value in other.items():
+        if isinstance(value, dict) and isinstance(keys.get(key), dict):
+            merge_keys(keys[key], value)
+        else:
+            keys[key] = value
+    return keys
+
+
+def pick(figure, keys):
+    return {key: pick(figure.get(key, {}), value) if isinstance(value, dict) else figure.get(key)
+            for key, value in keys.items()}
+
+
+def play_args(redraw=False):
+    return {'frame': {'duration': FRAME_DURATION, 'redraw': redraw},
+            'transition': {'duration': TRANSITION_DURATION}, 'fromcurrent': True}
+
+
+def animation_figure(figures, names, redraw=False):
+    # figures are Plotly JSON dicts (as returned by cached_figure) with the same traces in the same order;
+    # the first one is the figure shown before Play is pressed
+    if len({len(figure['data']) for figure in figures}) > 1:
+        raise ValueError('Animation frames must have the same number of traces')
+
+    base = figures[0]
+    trace_keys = [{} for _ in base['data']]
+    layout_keys = {}
+    for figure in figures[1:]:
+        for keys, base_trace, trace in zip(trace_keys, base['data'], figure['data']):
+            merge_keys(keys, changed_keys(base_trace, trace))
+        merge_keys(layout_keys, changed_keys(base['layout'], figure['layout']))
+
+    # each frame sets every attribute that changes anywhere in the animation, so frames can be played in any order
+    traces = [i for i, keys in enumerate(trace_keys) if keys]
+    frames = [{
+        'name': str(name),
+        'traces': traces,
+        'data': [dict(pick(figure['data'][i], trace_keys[i]), type=figure['data'][i].get('type')) for i in traces],
+        'layout': pick(figure['layout'], layout_keys),
+    } for name, figure in zip(names, figures)]
+
+    layout = dict(base['layout'])
+    layout['margin'] = dict(layout.get('margin', {}), b=90)
+    layout['updatemenus'] = [{
+        'type': 'buttons',
+        'direction': 'left',
+        'x': 0, 'y': 0, 'xanchor': 'left', 'yanchor': 'top',
+        'pad': {'t': 40},
+        'buttons': [
+            {'label': 'Play', 'method': 'animate', 'args': [None, play_args(redraw)]},
+            {'label': 'Pause', 'method': 'animate',
+             'args': [[None], {'frame': {'duration': 0, 'redraw': False}, 'mode': 'immediate'}]},
+        ],
+    }]
+    layout['sliders'] = [{
+        'x': 0.1, 'y': 0, 'len': 0.9, 'xanchor': 'left', 'yanchor': 'top',
+        'pad': {'t': 30},
+        'currentvalue': {'prefix': 'Year: '},
+        'steps': [{'label': str(name), 'method': 'animate',
+                   'args': [[str(name)], {'frame': {'duration': 0, 'redraw': redraw}, 'mode': 'immediate'}]}
+                  for name in names],
+    }]
+    return {'data': base['data'], 'layout': layout, 'frames': frames}
+
+
+def autoplay_script(graph_id, redraw=False):
+    # clientside callback that starts the animation once its figure has been drawn
+    return f'''
+    function(figure) {{
+        if (!figure || !figure.frames || !figure.frames.length) {{
+            return window.dash_clientside.no_update;
+        }}
+        setTimeout(function() {{
+            var graph = document.querySelector('#{graph_id} .js-plotly-plot');
+            if (graph) {{
+                Plotly.animate(graph, null, {json.dumps(play_args(redraw))});
+            }}
+        }}, 100);
+        return figure.frames.length;
+    }}
+    '''
+
+
+class AnimationBuilder:
+    # builds animations in a background thread, one per key, and keeps the latest MAX_ANIMATIONS
+    def __init__(self, build, max_animations=MAX_ANIMATIONS):
+        self.build = build
+        self.max_animations = max_animations
+        self.futures = OrderedDict()
+        self.pool = ThreadPoolExecutor(1)
+        self.lock = threading.Lock()
+
+    def submit(self, *key):
+        with self.lock:
+            if key not in self.futures or self.futures[key].cancelled():
+                # builds still queued for earlier selections are stale, so the new one does not wait behind them;
+                # cancel() leaves running and finished builds alone
+                for other in list(self.futures):
+                    if self.futures[other].cancel():
+                        del self.futures[other]
+                self.futures[key] = self.pool.submit(self.build, *key)
+            self.futures.move_to_end(key)
+            while len(self.futures) > self.max_animations:
+                self.futures.popitem(last=False)[1].cancel()
+            return self.futures[key]
+
+    def get(self, *key):
+        # a newer selection may cancel the queued build while it is awaited; queue it again then
+        while True:
+            try:
+                return self.submit(*key).result()
+            except CancelledError:
+                continue
+
+    def clear(self):
+        with self.lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures.clear()
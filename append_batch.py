@@ -0,0 +1,118 @@
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+from build_aggregates import (REGISTRY_COLUMNS, REGISTRY_DIR, REGISTRY_PARTITIONING, SANKEY_FILE, TOTALS_FILE,
+                              YEAR_COUNTS_FILE, decode_counts, read_version, save_pairs, write_registry,
+                              write_version)
+from comention import count_pairs, merge_pairs
+from mention_loader import clean_mentions, read_mentions, report_dropped
+from sankey_store import read_sankey_file, take_names
+from software_names import load_names
+
+# Adds a batch of new mentions (a delta TSV with the columns of comm_disambiguated.tsv) to the aggregates
+# written by build_aggregates.py, without re-reading the full file:
+#   software_year_counts.csv / software_totals.csv - the batch's mentions are added
+#   sankey_data.arrow / sankey_index/              - a publication (year, doi) the batch mentions contributes the
+#       pairs of its registered software plus the new ones, minus the pairs it contributed before, so a doi
+#       that gains mentions is corrected instead of counted twice
+#   doi_registry/                                  - the (year, doi, software id) rows the batch adds
+#   software_names.parquet                         - the names the batch adds, with new ids after the old ones
+#   aggregates_version.json                        - bumped last; lists the sha1 of every batch applied since the
+#       last full build, so the same batch is not applied twice
+#
+# python append_batch.py comm_disambiguated_2024_01.tsv
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_registry(dois, registry_dir=REGISTRY_DIR):
+    # the registered software of the given dois
+    if not os.path.isdir(registry_dir):
+        return pd.DataFrame(columns=REGISTRY_COLUMNS)
+    dataset = ds.dataset(registry_dir, format='parquet', partitioning=REGISTRY_PARTITIONING)
+    table = dataset.to_table(columns=REGISTRY_COLUMNS, filter=ds.field('doi').isin(list(dois)))
+    return table.to_pandas()
+
+
+def read_pairs(path=SANKEY_FILE):
+    # sankey_data.arrow back as count_pairs rows
+    data = read_sankey_file(path)
+    pairs = pd.DataFrame({
+        'year': data['year'].astype(np.int64),
+        'Count': data['count'].astype(np.int64),
+        'Source': take_names(data['names'], data['source']),
+        'Target': take_names(data['names'], data['target']),
+    })
+    return pairs, data['years'], data['bounds']
+
+
+def read_year_counts(path=YEAR_COUNTS_FILE):
+    return pd.read_csv(path, index_col=['year', 'mapped_to_software'], keep_default_na=False,
+                       na_values=[])['count']
+
+
+def pair_increment(registered, mentions, names):
+    # pairs of the touched publications after the batch, minus their pairs before it
+    before = count_pairs(registered, names=names)
+    after = count_pairs(pd.concat([registered, mentions], ignore_index=True), names=names)
+    increment = merge_pairs([after, before.assign(Count=-before['Count'])])
+    return increment[increment['Count'] != 0]
+
+
+def append_batch(delta_path, chunksize=1000000):
+    digest = file_digest(delta_path)
+    version = read_version()
+    if digest in version['batches']:
+        print(f'{delta_path} was already applied')
+        return version['version']
+
+    names = load_names()
+    mentions, dropped, total = [], 0, 0
+    for chunk in read_mentions(delta_path, chunksize=chunksize):
+        total += len(chunk)
+        chunk, chunk_dropped = clean_mentions(chunk, names=names)
+        dropped = dropped + chunk_dropped
+        mentions.append(chunk[REGISTRY_COLUMNS])
+    mentions = pd.concat(mentions, ignore_index=True)
+    report_dropped(dropped, total)
+
+    year_counts = read_year_counts()
+    counts = decode_counts(mentions.groupby(['year', 'software_id']).size(), names)
+    year_counts = year_counts.add(counts, fill_value=0).astype(int).rename('count')
+
+    # only the registered rows of the publications the batch touches are needed
+    registered = load_registry(mentions['doi'].dropna().unique())
+    registered = registered.astype({'year': np.int64, 'software_id': np.int32}).merge(
+        mentions[['year', 'doi']].drop_duplicates().astype({'year': np.int64}), on=['year', 'doi'])
+    # the batch is counted exactly, so the bounds of approximate counts carry over unchanged
+    pairs, (min_year, max_year), bounds = read_pairs()
+    pairs = merge_pairs([pairs, pair_increment(registered, mentions, names)])
+    years = year_counts.index.get_level_values('year')
+
+    new_rows = mentions.drop_duplicates().astype({'year': np.int64})
+    new_rows = new_rows.merge(registered, how='left', indicator=True)
+    new_rows = new_rows[new_rows['_merge'] == 'left_only'][REGISTRY_COLUMNS]
+    write_registry(new_rows, REGISTRY_DIR, f'part-{version["version"] + 1}-0')
+    names.save()
+
+    year_counts.to_csv(YEAR_COUNTS_FILE)
+    year_counts.groupby(level='mapped_to_software').sum().sort_values(ascending=False).to_csv(TOTALS_FILE)
+    save_pairs(pairs, min(min_year, int(years.min())), max(max_year, int(years.max())), bounds=bounds)
+    print(f'{len(mentions)} mentions added, {len(registered.drop_duplicates(["year", "doi"]))} publications '
+          f'already registered')
+    return write_version(version['batches'] + [digest])
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        print(f'Aggregates version {append_batch(path)}')
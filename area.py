@@ -1,29 +1,32 @@
 import pandas as pd
+from mention_loader import clean_mentions, read_mentions, report_dropped
+from software_names import load_names
 
 ROOT_DATA_DIR = r'ROOTPATH'
 
-disambiguated_df = pd.read_csv(
+disambiguated_df = read_mentions(
     ROOT_DATA_DIR + '/disambiguated/comm_disambiguated.tsv.gz',
-    sep='\t',
-    engine='python',
-    compression='gzip',
     nrows=1000000  # Load only the first 1,000,000 rows for initial testing
 )
+total_rows = len(disambiguated_df)
 
-disambiguated_df['mapped_to_software'] = disambiguated_df.apply(
-    lambda x: x['software'] if x['mapped_to_software'] == 'not_disambiguated' else x['mapped_to_software'],
-    axis=1
-)
-
-disambiguated_df['year'] = disambiguated_df['pubdate'].astype(str).str[:4].astype(int, errors='ignore')
+# fall back to the raw software name for not_disambiguated mentions, matched to the canonical names
+# without case and version, drop rows without a year
+names = load_names()
+disambiguated_df, dropped = clean_mentions(disambiguated_df, fill_not_disambiguated=True, drop_not_software=False,
+                                           names=names)
+report_dropped(dropped, total_rows)
 
-software_counts = disambiguated_df['mapped_to_software'].value_counts()
+software_counts = disambiguated_df['software_id'].value_counts()
+software_counts = software_counts[software_counts.index >= 0]
 top_20_software = software_counts.head(20)
-print(top_20_software)
+print(top_20_software.set_axis(names.decode(top_20_software.index)))
 
 top_software_trends = disambiguated_df[
-    disambiguated_df['mapped_to_software'].isin(top_20_software.index)
-].groupby(['year', 'mapped_to_software']).size().unstack().fillna(0)
+    disambiguated_df['software_id'].isin(top_20_software.index)
+].groupby(['year', 'software_id']).size().unstack().fillna(0)
+# names only for the columns that are drawn
+top_software_trends.columns = names.decode(top_software_trends.columns)
 
 # show preview of top_software_trends
 print(top_software_trends)
@@ -1,11 +1,16 @@
 import dash
-from dash import dcc, html
+from dash import callback, dcc, html
 from dash.dependencies import Input, Output
+import numpy as np
+import os
 import pandas as pd
+from build_aggregates import YEAR_COUNTS_FILE, aggregates_version
+from data_reload import watch_data
+from figure_cache import cached_figure, figure_cache
+from metrics import instrumented, register, stage
+from mention_store import load_mentions, store_path
 import plotly.express as px
 
-app = dash.Dash(__name__)
-
 # data processing
 ROOT_DATA_DIR = r'ROOTPATH'
 
@@ -14,58 +19,99 @@ file_path = ROOT_DATA_DIR + '/disambiguated/comm_disambiguated.tsv'
 if using_sample:
     file_path = file_path[:-4] + '_sample.tsv'
 
-disambiguated_df = pd.read_csv(
-    file_path,
-    sep='\t',
-    engine='python',
-    # compression='gzip',
-    # nrows=2000000
-)
+# Mentions per (year, software) as a dense int32 matrix, so callbacks only slice this small cube
+# instead of filtering the row-level mentions. Uses software_year_counts.csv from build_aggregates.py
+# when it exists, otherwise counts the rows of the mention store once.
+def load_year_counts():
+    if os.path.exists(YEAR_COUNTS_FILE):
+        counts_df = pd.read_csv(YEAR_COUNTS_FILE, keep_default_na=False, na_values=[])
+        codes, names = pd.factorize(counts_df['mapped_to_software'], sort=True)
+        return counts_df['year'].to_numpy(), codes, names, counts_df['count'].to_numpy()
+
+    disambiguated_df = load_mentions(
+        file_path,
+        columns=['year', 'mapped_to_software', 'curation_label']
+    )
+
+    # filter ['mapped_to_software'] != 'not_disambiguated' and ['curation_label'] != 'not_software'
+    disambiguated_df = disambiguated_df[disambiguated_df['mapped_to_software'] != 'not_disambiguated']
+    disambiguated_df = disambiguated_df[disambiguated_df['curation_label'] != 'not_software']
+
+    software = disambiguated_df['mapped_to_software'].cat.remove_unused_categories()
+    codes = software.cat.codes.to_numpy()
+    # mentions without a software name have code -1 and are not counted, as groupby dropped NaN
+    named = codes >= 0
+    return disambiguated_df['year'].to_numpy()[named], codes[named], software.cat.categories, None
 
-# filter ['mapped_to_software'] != 'not_disambiguated' and ['curation_label'] != 'not_software'
-disambiguated_df = disambiguated_df[disambiguated_df['mapped_to_software'] != 'not_disambiguated']
-disambiguated_df = disambiguated_df[disambiguated_df['curation_label'] != 'not_software']
+def load_year_cube():
+    year, codes, software_names, counts = load_year_counts()
 
-disambiguated_df['year'] = disambiguated_df['pubdate'].astype(str).str[:4].astype(int, errors='ignore')
+    min_year = int(year.min())
+    max_year = int(year.max())
 
-disambiguated_df['year'] = disambiguated_df['year'].dropna().astype(int)
+    year_counts = np.bincount(
+        (year - min_year).astype(np.int64) * len(software_names) + codes,
+        weights=counts,
+        minlength=(max_year - min_year + 1) * len(software_names)
+    ).astype(np.int32).reshape(max_year - min_year + 1, len(software_names))
+    return {'year_counts': year_counts, 'software_names': software_names, 'min_year': min_year, 'max_year': max_year}
 
-min_year = disambiguated_df['year'].min()
-max_year = disambiguated_df['year'].max()
+# reloaded in the background whenever build_aggregates.py or append_batch.py writes a new version
+area_data = watch_data('year_counts', load_year_cube, lambda: aggregates_version(YEAR_COUNTS_FILE, store_path(file_path)))
+area_data.subscribe(lambda: figure_cache.clear('area'))
+
+min_year, max_year = area_data.get()['min_year'], area_data.get()['max_year']
 
 # Function to update the figure based on the selected N
+@cached_figure('area', version=area_data.version)
 def update_figure(selected_N, value_type, year_range):
+    # one version of the data for the whole call, even if a reload swaps it meanwhile
+    data = area_data.get()
+    year_counts, software_names = data['year_counts'], data['software_names']
+    min_year, max_year = data['min_year'], data['max_year']
+
     # Filter data based on the selected year range
-    df_filtered = disambiguated_df[(disambiguated_df['year'] >= year_range[0]) & (disambiguated_df['year'] <= year_range[1])]
+    first = max(year_range[0], min_year) - min_year
+    last = min(year_range[1], max_year) - min_year + 1
+    window = year_counts[first:max(first, last)]
 
-    software_counts = df_filtered['mapped_to_software'].value_counts()
-    top_software = software_counts.head(selected_N)
+    # Top N software in the range, ties in name order; columns stay in name order like unstack()
+    software_counts = window.sum(axis=0, dtype=np.int64)
+    top_software = np.flatnonzero(software_counts)
+    if len(top_software) > selected_N:
+        kth = np.partition(software_counts[top_software], len(top_software) - selected_N)[len(top_software) - selected_N]
+        top_software = top_software[software_counts[top_software] >= kth]
+        top_software = top_software[np.lexsort((top_software, -software_counts[top_software]))][:selected_N]
+    top_software = np.sort(top_software)
 
-    top_software_trends = df_filtered[
-        df_filtered['mapped_to_software'].isin(top_software.index)
-    ].groupby(['year', 'mapped_to_software']).size().unstack().fillna(0)
+    top_software_trends = window[:, top_software].astype(float)
 
     # Calculate the total mentions of all software in each year
-    total_mentions_per_year = df_filtered.groupby('year')['mapped_to_software'].size()
+    total_mentions_per_year = window.sum(axis=1, dtype=np.int64)
+
+    # keep the years in which any of the top software is mentioned
+    years = np.flatnonzero(top_software_trends.sum(axis=1) > 0)
+    top_software_trends = top_software_trends[years]
 
     if value_type == 'percentage':
         # Use total mentions for percentage calculation
-        top_software_trends = top_software_trends.divide(total_mentions_per_year, axis=0) * 100
-        top_software_trends = top_software_trends.fillna(0)  # fill NaN values with 0
+        top_software_trends = top_software_trends / total_mentions_per_year[years, None] * 100
 
-    top_software_trends = top_software_trends.reset_index()
+    top_software_trends = pd.DataFrame(top_software_trends, columns=software_names[top_software])
+    top_software_trends.insert(0, 'year', years + min_year + first)
     melted_df = pd.melt(top_software_trends, id_vars='year', var_name='Software', value_name='Count')
 
     y_label = 'Percentage of Mentions' if value_type == 'percentage' else 'Number of Mentions'
     
-    fig = px.area(
-        melted_df,
-        x='year',
-        y='Count',
-        color='Software',
-        title=f'Trend of Software Mentions Over Time (Top {selected_N})',
-        labels={'Count': y_label}
-    )
+    with stage('area', 'px.area'):
+        fig = px.area(
+            melted_df,
+            x='year',
+            y='Count',
+            color='Software',
+            title=f'Trend of Software Mentions Over Time (Top {selected_N})',
+            labels={'Count': y_label}
+        )
 
     for i in range(len(fig['data'])):
         fig['data'][i]['line']['width'] = 0
@@ -73,12 +119,12 @@ def update_figure(selected_N, value_type, year_range):
     return fig
 
 # Dash app layout
-app.layout = html.Div([
+layout = html.Div([
     html.Div([
         html.Div([
             html.H6('N Most Cited Software:', style={'marginBottom': 5, 'marginTop': 0}),
             dcc.Dropdown(
-                id='n-selector',
+                id='area-n-selector',
                 options=[
                     {'label': 'Top 5', 'value': 5},
                     {'label': 'Top 10', 'value': 10},
@@ -92,7 +138,7 @@ app.layout = html.Div([
         html.Div([
             html.H6('Value Type:', style={'marginBottom': 5, 'marginTop': 0}),
             dcc.Dropdown(
-                id='value-type-selector',
+                id='area-value-type-selector',
                 options=[
                     {'label': 'Absolute', 'value': 'absolute'},
                     {'label': 'Percentage', 'value': 'percentage'}
@@ -104,7 +150,7 @@ app.layout = html.Div([
 
     html.Div([
         dcc.RangeSlider(
-            id='year-slider',
+            id='area-year-slider',
             min=1970,
             max=2021,
             step=1,
@@ -114,21 +160,25 @@ app.layout = html.Div([
     ], style={'padding': '10px', 'boxShadow': '0px 0px 5px #ccc', 'borderRadius': '5px', 'marginBottom': '20px'}),
 
 dcc.Graph(
-        id='software-trend',
+        id='area-software-trend',
         figure=update_figure(25, 'percentage', [1995, 2021]),
         style={'height': '70vh'}  # Set the height of the graph
     ),
 ], style={'padding': '10px', 'height': '100vh', 'margin': '0'})
 
 
-@app.callback(
-    Output('software-trend', 'figure'),
-    [Input('n-selector', 'value'),
-     Input('value-type-selector', 'value'),
-     Input('year-slider', 'value')]
+@callback(
+    Output('area-software-trend', 'figure'),
+    [Input('area-n-selector', 'value'),
+     Input('area-value-type-selector', 'value'),
+     Input('area-year-slider', 'value')]
 )
+@instrumented('area')
 def update_graph(selected_N, value_type, year_range):
     return update_figure(selected_N, value_type, year_range)
 
 if __name__ == '__main__':
+    app = dash.Dash(__name__)
+    app.layout = layout
+    register(app.server)
     app.run_server(debug=False)
@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+# Benchmark harness on synthetic data (see synthetic_data.py), so the pipeline can be measured without
+# the private dataset. Every (rows, stage) runs in its own process, so the peak RSS it reports belongs
+# to that stage alone. Results are written as JSON to track regressions.
+#
+#   generate        - write the synthetic comm_disambiguated.tsv
+#   ingest          - build the Parquet mention store (mention_store.py)
+#   aggregates      - streaming pass of build_aggregates.py
+#   sankey_cal      - load, clean and count co-mention pairs, then save them, like sankey_cal.py
+#   out_of_core     - the same pairs counted by external_pairs.py
+#   heavy_hitters   - the candidate top pairs counted by heavy_pairs.py
+#   update_figure   - area_dash.py callback
+#   create_sankey   - sankey_quickdash.py figure from the pair index
+#   create_network  - network_quickdash.py figure from the pair index
+# The figure stages also report the JSON size of each figure (payload_bytes), see payload.py.
+#
+# python benchmark.py --rows 1e5 1e6 --output benchmark_results.json
+
+STAGES = ['generate', 'ingest', 'aggregates', 'sankey_cal', 'out_of_core', 'heavy_hitters', 'update_figure',
+          'create_sankey', 'create_network']
+CALLBACK_N = [25, 100, 250]
+WORK_DIR = 'benchmark_data'
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def run_stage(stage, rows, work_dir):
+    # runs in the stage's own process, inside work_dir, where the apps find their data files
+    file_path = os.path.abspath(os.path.join(work_dir, 'comm_disambiguated.tsv'))
+    os.chdir(work_dir)
+    timings, payload_bytes = {}, {}
+
+    if stage == 'generate':
+        from synthetic_data import write_synthetic
+        timings['write'], _ = timed(write_synthetic, file_path, rows)
+
+    elif stage == 'ingest':
+        from mention_store import build_store, store_path
+        shutil.rmtree(store_path(file_path), ignore_errors=True)
+        timings['build_store'], _ = timed(build_store, file_path)
+
+    elif stage == 'aggregates':
+        from build_aggregates import TOTALS_FILE, YEAR_COUNTS_FILE, build_aggregates, save_pairs
+        timings['build'], (year_counts, totals, pairs) = timed(build_aggregates, file_path)
+        year_counts.to_csv(YEAR_COUNTS_FILE)
+        totals.to_csv(TOTALS_FILE)
+        years = year_counts.index.get_level_values('year')
+        timings['save'], _ = timed(save_pairs, pairs, int(years.min()), int(years.max()))
+
+    elif stage == 'sankey_cal':
+        from build_aggregates import save_pairs
+        from comention import count_pairs
+        from mention_loader import clean_mentions, read_mentions
+        from software_names import SoftwareNames
+        names = SoftwareNames()
+        timings['read'], df = timed(read_mentions, file_path)
+        timings['clean'], (df, _) = timed(lambda: clean_mentions(df, names=names))
+        timings['count_pairs'], pairs = timed(lambda: count_pairs(df[['doi', 'year', 'software_id']], names=names))
+        timings['save'], _ = timed(save_pairs, pairs, int(df['year'].min()), int(df['year'].max()))
+
+    elif stage == 'out_of_core':
+        from external_pairs import external_count_pairs
+        timings['count_pairs'], _ = timed(external_count_pairs, file_path)
+
+    elif stage == 'heavy_hitters':
+        from heavy_pairs import heavy_hitter_pairs
+        timings['count_pairs'], _ = timed(heavy_hitter_pairs, file_path)
+
+    elif stage == 'update_figure':
+        timings['import'], area_dash = timed(__import__, 'area_dash')
+        year_range = [area_dash.min_year, area_dash.max_year]
+        for selected_N in CALLBACK_N:
+            for value_type in ['absolute', 'percentage']:
+                # the undecorated callback, the figure cache would turn repeated calls into lookups
+                timings[f'N={selected_N},{value_type}'], _ = timed(
+                    area_dash.update_figure.__wrapped__, selected_N, value_type, year_range)
+
+    elif stage in ('create_sankey', 'create_network'):
+        from pair_index import top_pairs
+        from payload import compact_figure, payload_size
+        module = 'sankey_quickdash' if stage == 'create_sankey' else 'network_quickdash'
+        timings['import'], app = timed(__import__, module)
+        year_range = [int(year) for year in app.pair_data.get()['years']]
+        for selected_N in CALLBACK_N:
+            connections_df = top_pairs(app.pair_data.get(), year_range, selected_N)
+            if stage == 'create_sankey':
+                timings[f'N={selected_N}'], figure = timed(app.create_sankey, connections_df, selected_N)
+            else:
+                timings[f'N={selected_N}'], figure = timed(app.create_network, connections_df, selected_N, year_range)
+            # what the browser receives, as is and as compacted for a PAYLOAD_BUDGET
+            payload_bytes[f'N={selected_N}'] = payload_size(figure)
+            payload_bytes[f'N={selected_N},compact'] = payload_size(compact_figure(figure))
+
+    else:
+        raise ValueError(f'Unknown stage: {stage}')
+
+    result = {'seconds': sum(timings.values()), 'timings': timings, 'peak_rss_mb': peak_rss_mb()}
+    if payload_bytes:
+        result['payload_bytes'] = payload_bytes
+    return result
+
+
+def benchmark(rows_list, stages, work_dir):
+    results = []
+    for rows in rows_list:
+        rows_dir = os.path.join(work_dir, f'rows_{rows}')
+        os.makedirs(rows_dir, exist_ok=True)
+        for stage in stages:
+            process = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--stage', stage, '--rows', str(rows), '--work-dir', rows_dir],
+                capture_output=True, text=True
+            )
+            if process.returncode == 0:
+                result = json.loads(process.stdout.strip().splitlines()[-1])
+            else:
+                # e.g. out of memory at 10^8 rows; keep the error and go on with the next stage
+                result = {'error': process.stderr.strip().splitlines()[-1] if process.stderr.strip() else
+                          f'exit code {process.returncode}'}
+            results.append(dict(rows=rows, stage=stage, **result))
+            print(f"{rows:>11} {stage:15s} {result.get('seconds', float('nan')):9.3f} s "
+                  f"{result.get('peak_rss_mb', float('nan')):9.1f} MB {result.get('error', '')}", file=sys.stderr)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic data')
+    parser.add_argument('--rows', type=float, nargs='+', default=[1e5, 1e6])
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--work-dir', default=WORK_DIR)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--stage', choices=STAGES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        print(json.dumps(run_stage(args.stage, int(args.rows[0]), args.work_dir)))
+    else:
+        report = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'results': benchmark([int(rows) for rows in args.rows], args.stages, args.work_dir),
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}', file=sys.stderr)
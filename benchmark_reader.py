@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from mention_loader import RAW_COLUMNS, read_mentions
+from synthetic_data import write_synthetic
+
+# Compares the TSV readers on a synthetic file of the same shape as comm_disambiguated.tsv.
+#
+# python benchmark_reader.py [rows]
+
+
+def best_time(read, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        read()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def stream(path):
+    for chunk in read_mentions(path, chunksize=1000000):
+        pass
+
+
+if __name__ == '__main__':
+    rows = int(float(sys.argv[1])) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_synthetic(os.path.join(tmp, 'comm_disambiguated.tsv'), rows)
+        gz_path = write_synthetic(os.path.join(tmp, 'comm_disambiguated.tsv.gz'), rows)
+
+        readers = {
+            "pd.read_csv engine='python'": lambda: pd.read_csv(path, sep='\t', engine='python', usecols=RAW_COLUMNS),
+            'pd.read_csv, dtype=str': lambda: pd.read_csv(path, sep='\t', usecols=RAW_COLUMNS, dtype=str),
+            'read_mentions': lambda: read_mentions(path),
+            'read_mentions, .gz': lambda: read_mentions(gz_path),
+            'read_mentions, .gz in 1M-row chunks': lambda: stream(gz_path),
+        }
+        baseline = None
+        for name, read in readers.items():
+            seconds = best_time(read)
+            baseline = baseline or seconds
+            print(f'{name:40s} {seconds:8.2f} s {baseline / seconds:6.1f}x')
@@ -0,0 +1,167 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from comention import pairs_to_sankey_data
+from external_pairs import GROUP_ROWS, HASH_BUCKETS, count_spilled, spill_chunk
+from mention_loader import clean_mentions, read_mentions, report_dropped
+from pair_index import index_from_pairs, save_pair_index
+from sankey_store import write_sankey_file
+from software_names import load_names
+
+# Single streaming pass over comm_disambiguated.tsv (or .tsv.gz) that writes every precomputed aggregate:
+#   software_year_counts.csv - mentions per (year, software), used by area_dash.py
+#   software_totals.csv      - mentions per software over all years
+#   sankey_data.arrow        - per-year co-mention pair counts, see sankey_store.py
+#   sankey_index/            - cumulative pair-count index, see pair_index.py
+#   sankey_data.json         - the same pair counts as JSON, only with write_json
+#   doi_registry/            - the software ids each publication mentions, so append_batch.py can add later batches
+#   software_names.parquet   - the canonical software names behind the ids, see software_names.py
+#   aggregates_version.json  - version stamp, bumped after every build or appended batch
+# The file is read in chunks, so memory is bounded by the chunk size plus the size of the aggregates.
+# The rows of a publication need not be adjacent: for the pair counts the cleaned rows are spilled to year / doi-hash
+# buckets and counted bucket group by bucket group, like external_pairs.py, or by the count function passed in
+# (heavy_pairs.count_heavy_hitters), so every mode of sankey_cal.py reads the file once.
+# Mentions are counted by software id and the names decoded once, when the aggregates are written.
+
+ROOT_DATA_DIR = r'ROOTPATH'
+
+YEAR_COUNTS_FILE = 'software_year_counts.csv'
+TOTALS_FILE = 'software_totals.csv'
+SANKEY_FILE = 'sankey_data.arrow'
+SANKEY_JSON_FILE = 'sankey_data.json'
+SANKEY_INDEX_DIR = 'sankey_index'
+REGISTRY_DIR = 'doi_registry'
+VERSION_FILE = 'aggregates_version.json'
+
+REGISTRY_COLUMNS = ['year', 'doi', 'software_id']
+REGISTRY_PARTITIONING = ds.partitioning(pa.schema([('year', pa.int16())]), flavor='hive')
+
+
+def write_registry(rows, registry_dir, name):
+    # (year, doi, software id) rows, partitioned by year like the mention store
+    table = pa.table({'year': pa.array(rows['year'].to_numpy(), type=pa.int16()),
+                      'doi': pa.array(rows['doi'], type=pa.string()),
+                      'software_id': pa.array(rows['software_id'].to_numpy(), type=pa.int32())})
+    ds.write_dataset(table, registry_dir, format='parquet', partitioning=REGISTRY_PARTITIONING,
+                     basename_template=f'{name}-{{i}}.parquet', existing_data_behavior='overwrite_or_ignore')
+
+
+def read_version():
+    if not os.path.exists(VERSION_FILE):
+        return {'version': 0, 'batches': []}
+    with open(VERSION_FILE, 'r') as f:
+        return json.load(f)
+
+
+def aggregates_version(*paths):
+    # the version stamp, or the modification time of the given files where no stamp was written
+    if os.path.exists(VERSION_FILE):
+        return read_version()['version']
+    return max((os.path.getmtime(path) for path in paths if os.path.exists(path)), default=0)
+
+
+def write_version(batches):
+    # written last and replaced atomically, so a reader that sees the new version sees every new file
+    stamp = {'version': read_version()['version'] + 1, 'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+             'batches': batches}
+    with open(VERSION_FILE + '.tmp', 'w') as f:
+        json.dump(stamp, f, indent=2)
+    os.replace(VERSION_FILE + '.tmp', VERSION_FILE)
+    return stamp['version']
+
+
+def decode_counts(counts, names):
+    # (year, software id) counts as (year, mapped_to_software) counts, without the mentions that have no name
+    counts = counts[counts.index.get_level_values('software_id') >= 0]
+    counts.index = counts.index.remove_unused_levels()
+    years, ids = counts.index.levels
+    counts.index = counts.index.set_levels([years, names.decode(ids)]).set_names(['year', 'mapped_to_software'])
+    return counts.sort_index()
+
+
+def year_totals(year_counts, names):
+    # (year, software id) counts as the year counts and totals that are written
+    year_counts = decode_counts(year_counts.astype(int).rename('count'), names)
+    totals = year_counts.groupby(level='mapped_to_software').sum().sort_values(ascending=False)
+    return year_counts, totals
+
+
+def mention_aggregates(df, names, registry_dir=REGISTRY_DIR):
+    # the year counts, totals and doi registry of cleaned mentions already in memory
+    shutil.rmtree(registry_dir, ignore_errors=True)
+    write_registry(df[REGISTRY_COLUMNS].drop_duplicates(), registry_dir, 'part-0-0')
+    return year_totals(df.groupby(['year', 'software_id']).size(), names)
+
+
+def build_aggregates(file_path, chunksize=1000000, registry_dir=REGISTRY_DIR, names=None, group_rows=GROUP_ROWS,
+                     hash_buckets=HASH_BUCKETS, spill_dir=None, count=None):
+    # the ids of earlier builds are kept, so the table is extended rather than rebuilt;
+    # count(spill_dir, sizes, names) replaces count_spilled, and its result is returned in place of the pairs
+    names = load_names() if names is None else names
+    shutil.rmtree(registry_dir, ignore_errors=True)
+    year_counts = pd.Series(dtype=np.int64, index=pd.MultiIndex.from_arrays(
+        [np.array([], dtype=np.int16), np.array([], dtype=np.int32)], names=['year', 'software_id']))
+    dropped = 0
+    total = 0
+
+    spill_dir = tempfile.mkdtemp(prefix='comention_spill_', dir=spill_dir)
+    try:
+        writers, sizes = {}, {}
+        try:
+            for i, chunk in enumerate(read_mentions(file_path, chunksize=chunksize)):
+                total += len(chunk)
+                chunk, chunk_dropped = clean_mentions(chunk, names=names)
+                dropped = dropped + chunk_dropped
+
+                counts = chunk.groupby(['year', 'software_id']).size()
+                year_counts = year_counts.add(counts, fill_value=0)
+                write_registry(chunk[REGISTRY_COLUMNS].drop_duplicates(), registry_dir, f'part-0-{i}')
+                spill_chunk(chunk, spill_dir, writers, sizes, hash_buckets)
+                print(f'Chunk {i}: {len(chunk)} mentions')
+        finally:
+            for writer in writers.values():
+                writer.close()
+        if count is None:
+            pairs = count_spilled(spill_dir, sizes, names, group_rows)
+        else:
+            pairs = count(spill_dir, sizes, names)
+    finally:
+        shutil.rmtree(spill_dir)
+    report_dropped(dropped, total)
+    names.save()
+
+    year_counts, totals = year_totals(year_counts, names)
+    return year_counts, totals, pairs
+
+
+def save_pairs(pairs, min_year, max_year, write_json=False, bounds=None):
+    # bounds: the per-year undercount bound of heavy-hitter counts, None for exact counts
+    write_sankey_file(SANKEY_FILE, pairs, min_year, max_year, bounds)
+    save_pair_index(index_from_pairs(pairs, min_year, max_year, bounds), SANKEY_INDEX_DIR)
+    if write_json:
+        with open(SANKEY_JSON_FILE, 'w') as f:
+            json.dump(pairs_to_sankey_data(pairs, min_year, max_year), f)
+
+
+if __name__ == '__main__':
+    using_sample = 1
+    write_json = False
+    file_name = '/disambiguated/comm_disambiguated.tsv'
+    if using_sample != 1:
+        file_name = file_name[:-4] + f'_sample{using_sample}.tsv'
+
+    year_counts, totals, pairs = build_aggregates(ROOT_DATA_DIR + file_name)
+    if year_counts.empty:
+        raise SystemExit('No mentions left after cleaning, the aggregates were not written')
+
+    year_counts.to_csv(YEAR_COUNTS_FILE)
+    totals.to_csv(TOTALS_FILE)
+    years = year_counts.index.get_level_values('year')
+    save_pairs(pairs, years.min(), years.max(), write_json=write_json)
+    print(f'Aggregates version {write_version([])}')
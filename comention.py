@@ -0,0 +1,200 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# Co-mention counting shared by sankey_cal.py, build_aggregates.py and sankey_dash.py.
+# A pair of software is counted once for every publication (doi) that mentions both.
+#
+# Software names and dois are factorized to sorted integer codes (the canonical software_id column, ranked by name,
+# where the mentions were cleaned with a software_names table), the mentions are sorted by
+# (year, doi) and every publication is joined with itself on the sorted array, so all years are
+# counted at once without a Python loop per publication. Pairs come out in the order a
+# year-by-year groupby('doi') loop would first meet them.
+#
+# With workers > 1 the sorted mentions are split into publication-aligned shards that are counted
+# in a process pool and merged in shard order, which gives the same output as the serial run.
+#
+# sankey_dash.py keeps the encoded mentions as a per-publication CSR index and counts the pairs of
+# any year range on request, without a precomputed file.
+
+
+def encode_mentions(df, names=None):
+    if names is not None:
+        software, names = names.sorted_codes(df['software_id'].to_numpy())
+    else:
+        software, names = pd.factorize(df['mapped_to_software'], sort=True)
+    doi, _ = pd.factorize(df['doi'], sort=True)
+    year = df['year'].to_numpy(dtype=np.int64)
+
+    # rows without a doi or a software name never form a pair
+    valid = (software >= 0) & (doi >= 0)
+    year, doi, software = year[valid], doi[valid], software[valid]
+
+    # keep the first mention of a software in a publication, like group['mapped_to_software'].unique()
+    first = ~pd.DataFrame({'year': year, 'doi': doi, 'software': software}).duplicated().to_numpy()
+    year, doi, software = year[first], doi[first], software[first]
+
+    # stable sort, so the software of a publication stay in the order they were mentioned
+    order = np.lexsort((doi, year))
+    return year[order], doi[order], software[order], names
+
+
+def publication_starts(year, doi):
+    # (year, doi) is sorted, so each publication is a contiguous run of rows
+    new_group = np.ones(len(year), dtype=bool)
+    new_group[1:] = (year[1:] != year[:-1]) | (doi[1:] != doi[:-1])
+    return np.flatnonzero(new_group)
+
+
+def pair_instances(year, doi, software, positions=False):
+    # pair every row with the rows after it in the same publication; positions adds the two rows of each pair
+    n = len(software)
+    bounds = np.append(publication_starts(year, doi), n)
+    ends = np.repeat(bounds[1:], np.diff(bounds))
+
+    partners = ends - np.arange(n) - 1
+    left = np.repeat(np.arange(n), partners)
+    offsets = np.arange(len(left)) - np.repeat(np.cumsum(partners) - partners, partners)
+    right = left + offsets + 1
+
+    a, b = software[left], software[right]
+    if positions:
+        return year[left], np.minimum(a, b), np.maximum(a, b), left, right
+    return year[left], np.minimum(a, b), np.maximum(a, b)
+
+
+def pair_keys(year, doi, software, base_year, n):
+    # one int64 key per (year, source, target); factorize keeps first-appearance order
+    pair_year, source, target = pair_instances(year, doi, software)
+    key = ((pair_year - base_year) * n + source) * n + target
+    codes, keys = pd.factorize(key)
+    return keys, np.bincount(codes, minlength=len(keys))
+
+
+def shard_bounds(year, doi, shards):
+    # split the sorted mentions at publication boundaries into runs with about the same number of pairs
+    n = len(year)
+    if n == 0:
+        return [(0, 0)]
+    starts = np.append(publication_starts(year, doi), n)
+    sizes = np.diff(starts)
+    work = np.cumsum(sizes * (sizes - 1) // 2)
+
+    # cut after the publication that crosses each 1/shards share of the work
+    crossing = np.searchsorted(work, work[-1] * np.arange(1, shards) / shards, side='right')
+    bounds = np.unique(np.concatenate([[0], starts[np.minimum(crossing + 1, len(sizes))], [n]]))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+_shared = {}
+
+
+def attach_shared(name, n):
+    _shared['memory'] = shared_memory.SharedMemory(name=name)
+    _shared['mentions'] = np.ndarray((3, n), dtype=np.int64, buffer=_shared['memory'].buf)
+
+
+def count_shard(args):
+    start, end, base_year, n = args
+    year, doi, software = _shared['mentions'][:, start:end]
+    return pair_keys(year, doi, software, base_year, n)
+
+
+def pair_keys_parallel(year, doi, software, base_year, n, workers):
+    # the encoded mentions go into shared memory once, workers only receive row bounds
+    memory = shared_memory.SharedMemory(create=True, size=max(3 * len(year) * 8, 1))
+    try:
+        mentions = np.ndarray((3, len(year)), dtype=np.int64, buffer=memory.buf)
+        mentions[0], mentions[1], mentions[2] = year, doi, software
+        tasks = [(start, end, base_year, n) for start, end in shard_bounds(year, doi, workers * 4)]
+        # fork where available: sankey_cal.py runs at module level and must not be re-imported by workers
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=attach_shared,
+                                 initargs=(memory.name, len(year))) as pool:
+            results = list(pool.map(count_shard, tasks))
+        del mentions
+    finally:
+        memory.close()
+        memory.unlink()
+
+    # shards are contiguous runs of the sorted mentions, so merging them in order keeps the serial order
+    codes, keys = pd.factorize(np.concatenate([keys for keys, counts in results]))
+    counts = np.bincount(codes, weights=np.concatenate([counts for keys, counts in results]), minlength=len(keys))
+    return keys, counts.astype(np.int64)
+
+
+def count_pairs(df, workers=1, names=None):
+    year, doi, software, names = encode_mentions(df, names)
+    n = max(len(names), 1)
+    base_year = year.min() if len(year) else 0
+
+    if workers > 1:
+        keys, counts = pair_keys_parallel(year, doi, software, base_year, n, workers)
+    else:
+        keys, counts = pair_keys(year, doi, software, base_year, n)
+
+    return pd.DataFrame({
+        'year': keys // (n * n) + base_year,
+        'Count': counts,
+        'Source': names[keys // n % n],
+        'Target': names[keys % n],
+    })
+
+
+def build_publication_index(df):
+    # CSR index of the software every publication mentions: publication i has
+    # software[offsets[i]:offsets[i + 1]], publications sorted by (year, doi); by_doi lists the
+    # publications in doi order, a doi listed under several years in year order
+    year, doi, software, names = encode_mentions(df)
+    starts = publication_starts(year, doi)
+    return {
+        'year': year[starts],
+        'doi': doi[starts],
+        'by_doi': np.argsort(doi[starts], kind='stable'),
+        'offsets': np.append(starts, len(software)),
+        'software': software,
+        'names': names,
+    }
+
+
+def publication_pairs(index, year_range):
+    # co-mention counts of the publications in [y0, y1], in the order a groupby('doi') loop meets the pairs
+    start, end = np.searchsorted(index['year'], [year_range[0], year_range[1] + 1])
+    offsets = index['offsets']
+
+    # visit the publications of the range in doi order
+    by_doi = index['by_doi']
+    pubs = by_doi[(by_doi >= start) & (by_doi < end)]
+    pub_doi = index['doi'][pubs]
+    lengths = offsets[pubs + 1] - offsets[pubs]
+    rows = np.repeat(offsets[pubs] - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+    doi, software = np.repeat(pub_doi, lengths), index['software'][rows]
+
+    # such a doi is a single publication for the range, mentioning each software once
+    if (pub_doi[1:] == pub_doi[:-1]).any():
+        first = ~pd.DataFrame({'doi': doi, 'software': software}).duplicated().to_numpy()
+        doi, software = doi[first], software[first]
+
+    names = index['names']
+    n = max(len(names), 1)
+    keys, counts = pair_keys(np.zeros(len(doi), dtype=np.int64), doi, software, 0, n)
+    return pd.DataFrame({
+        'Count': counts,
+        'Source': names[keys // n % n],
+        'Target': names[keys % n],
+    })
+
+
+def pairs_to_sankey_data(pairs, min_year, max_year):
+    records = {year: group[['Count', 'Source', 'Target']].to_dict(orient='records')
+               for year, group in pairs.groupby('year', sort=False)}
+    return {year: records.get(year, []) for year in range(min_year, max_year + 1)}
+
+
+def merge_pairs(frames):
+    # sum partial counts of the same (year, pair), keeping first-appearance order
+    pairs = pd.concat(frames, ignore_index=True)
+    return pairs.groupby(['year', 'Source', 'Target'], sort=False, as_index=False)['Count'].sum()
@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+import traceback
+
+# Hot reload of the precomputed aggregates in running Dash apps.
+# A DataWatcher holds (version, data) as one tuple and polls a cheap version function, by default the
+# aggregates_version.json stamp that build_aggregates.py / append_batch.py write last. A new version is loaded
+# in the watcher's thread and swapped in with a single assignment; a callback that already took the old data
+# keeps using it, and the files behind it stay valid because the writers replace files instead of rewriting them.
+# Subscribers are called after each swap to drop caches built from the old version.
+#
+# The polling thread is started on first use in each process, so it also runs in workers forked after
+# gunicorn --preload.
+
+RELOAD_INTERVAL = 30  # seconds between version checks
+
+
+class DataWatcher:
+    def __init__(self, load, version, interval=RELOAD_INTERVAL):
+        self.load = load
+        self.version_func = version
+        self.interval = interval
+        self.current = (version(), load())
+        self.subscribers = []
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.pid != os.getpid():
+            self.start()
+        return self.current[1]
+
+    def version(self):
+        return self.current[0]
+
+    def subscribe(self, func):
+        self.subscribers.append(func)
+
+    def check(self):
+        # returns True when a new version was swapped in
+        version = self.version_func()
+        if version == self.current[0]:
+            return False
+        data = self.load()
+        self.current = (version, data)
+        for func in self.subscribers:
+            func()
+        print(f'Reloaded data version {version}')
+        return True
+
+    def watch(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                # a half-written or broken update must not stop the app; keep serving the old data
+                traceback.print_exc()
+
+    def start(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target=self.watch, daemon=True).start()
+
+
+_watchers = {}
+_lock = threading.Lock()
+
+
+def watch_data(name, load, version, interval=RELOAD_INTERVAL):
+    # one watcher per name and process, shared by every app that serves the same data
+    with _lock:
+        if name not in _watchers:
+            _watchers[name] = DataWatcher(load, version, interval)
+        return _watchers[name]
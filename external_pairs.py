@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from comention import count_pairs, encode_mentions, pair_instances, publication_starts
+from mention_loader import clean_mentions, read_mentions, report_dropped
+from software_names import SoftwareNames
+
+# Out-of-core co-mention counting for files whose mentions do not fit in memory (sankey_cal.py with out_of_core).
+#
+# One streaming pass spills the cleaned (doi, year, software id) rows to Arrow files bucketed by year and doi hash,
+# so every publication lands in exactly one bucket. The buckets of a year are then counted in groups of at most
+# group_rows mentions. Every partial count remembers where its pair was first met (doi and the positions of the
+# two mentions in the publication); merging the partial counts of a year in that order and concatenating the
+# years gives the same pairs, counts and order as count_pairs on the whole file.
+
+SPILL_COLUMNS = ['doi', 'year', 'software_id']
+SPILL_SCHEMA = pa.schema([('doi', pa.string()), ('year', pa.int16()), ('software_id', pa.int32())])
+HASH_BUCKETS = 16  # doi-hash buckets per year
+GROUP_ROWS = 20000000  # mentions counted at once
+
+
+def bucket_path(spill_dir, key):
+    return os.path.join(spill_dir, f'{key[0]}_{key[1]}.arrow')
+
+
+def spill_chunk(chunk, spill_dir, writers, sizes, hash_buckets=HASH_BUCKETS):
+    # appends the cleaned rows to their (year, doi hash) buckets, opening writers and counting rows per bucket
+    # sort the chunk by bucket, keeping file order within a bucket, and write each run of rows
+    doi_hash = pd.util.hash_pandas_object(chunk['doi'], index=False).to_numpy() % np.uint64(hash_buckets)
+    bucket = chunk['year'].to_numpy().astype(np.int64) * hash_buckets + doi_hash.astype(np.int64)
+    order = np.argsort(bucket, kind='stable')
+    table = pa.Table.from_pandas(chunk[SPILL_COLUMNS], schema=SPILL_SCHEMA, preserve_index=False).take(order)
+    bucket = bucket[order]
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]]) if len(bucket) else bucket
+    for start, end in zip(starts, np.append(starts[1:], len(bucket))):
+        key = (int(bucket[start] // hash_buckets), int(bucket[start] % hash_buckets))
+        if key not in writers:
+            writers[key] = pa.ipc.new_stream(bucket_path(spill_dir, key), SPILL_SCHEMA)
+            sizes[key] = 0
+        writers[key].write_table(table.slice(start, end - start))
+        sizes[key] += int(end - start)
+
+
+def spill_mentions(file_path, spill_dir, names, hash_buckets=HASH_BUCKETS, chunksize=1000000):
+    # returns the number of rows spilled to each (year, doi hash) bucket
+    writers, sizes = {}, {}
+    dropped, total = 0, 0
+    try:
+        for chunk in read_mentions(file_path, chunksize=chunksize):
+            total += len(chunk)
+            chunk, chunk_dropped = clean_mentions(chunk, names=names)
+            dropped = dropped + chunk_dropped
+            spill_chunk(chunk, spill_dir, writers, sizes, hash_buckets)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    report_dropped(dropped, total)
+    return sizes
+
+
+def year_groups(sizes, year, group_rows=GROUP_ROWS):
+    # consecutive buckets of a year with at most group_rows rows, unless a single bucket is larger
+    groups, group, rows = [], [], 0
+    for key in sorted(key for key in sizes if key[0] == year):
+        if group and rows + sizes[key] > group_rows:
+            groups.append(group)
+            group, rows = [], 0
+        group.append(key)
+        rows += sizes[key]
+    return groups + [group]
+
+
+def read_buckets(spill_dir, keys):
+    tables = [pa.ipc.open_stream(pa.memory_map(bucket_path(spill_dir, key))).read_all() for key in keys]
+    return pa.concat_tables(tables).to_pandas()
+
+
+def group_pairs(df, names):
+    # count_pairs of one group, plus the doi and in-publication positions of each pair's first instance
+    year, doi, software, names = encode_mentions(df, names)
+    dois = np.sort(df['doi'].dropna().unique())
+    n = max(len(names), 1)
+    base_year = year.min() if len(year) else 0
+
+    pair_year, source, target, left, right = pair_instances(year, doi, software, positions=True)
+    codes, keys = pd.factorize(((pair_year - base_year) * n + source) * n + target)
+    # factorize numbers pairs in order of appearance, so a pair is first met where its code exceeds all before it
+    first = np.flatnonzero(np.r_[True, codes[1:] > np.maximum.accumulate(codes)[:-1]]) if len(codes) else codes
+    left, right = left[first], right[first]
+
+    starts = publication_starts(year, doi)
+    row_start = np.repeat(starts, np.diff(np.append(starts, len(year))))
+    return pd.DataFrame({
+        'year': keys // (n * n) + base_year,
+        'Count': np.bincount(codes, minlength=len(keys)),
+        'Source': names[keys // n % n],
+        'Target': names[keys % n],
+        'first_doi': dois[doi[left]],
+        'first_left': left - row_start[left],
+        'first_right': right - row_start[left],
+    })
+
+
+def merge_partial(frames):
+    # a pair keeps its earliest first instance over all groups, like a single count over the whole year
+    pairs = pd.concat(frames, ignore_index=True)
+    pairs = pairs.sort_values(['first_doi', 'first_left', 'first_right'], kind='stable')
+    return pairs.groupby(['year', 'Source', 'Target'], sort=False, as_index=False)['Count'].sum()
+
+
+def count_spilled(spill_dir, sizes, names, group_rows=GROUP_ROWS):
+    # the count_pairs frame of the spilled buckets, year by year
+    pairs = []
+    for year in sorted({year for year, _ in sizes}):
+        groups = year_groups(sizes, year, group_rows)
+        if len(groups) == 1:
+            year_pairs = count_pairs(read_buckets(spill_dir, groups[0]), names=names)
+        else:
+            year_pairs = merge_partial([group_pairs(read_buckets(spill_dir, keys), names) for keys in groups])
+        pairs.append(year_pairs[['year', 'Count', 'Source', 'Target']])
+        print(f'Year {year}: {len(groups)} groups, {len(year_pairs)} connections')
+    return pd.concat(pairs, ignore_index=True) if pairs else pd.DataFrame(columns=['year', 'Count', 'Source', 'Target'])
+
+
+def external_count_pairs(file_path, group_rows=GROUP_ROWS, hash_buckets=HASH_BUCKETS, spill_dir=None, names=None):
+    # returns the count_pairs frame and the min / max year of the cleaned mentions
+    names = SoftwareNames() if names is None else names
+    spill_dir = tempfile.mkdtemp(prefix='comention_spill_', dir=spill_dir)
+    try:
+        sizes = spill_mentions(file_path, spill_dir, names, hash_buckets)
+        pairs = count_spilled(spill_dir, sizes, names, group_rows)
+    finally:
+        shutil.rmtree(spill_dir)
+
+    years = {year for year, _ in sizes}
+    return pairs, min(years, default=None), max(years, default=None)
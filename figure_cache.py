@@ -0,0 +1,141 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+from metrics import figure_bytes, stage
+
+# Server-side memo of callback figures shared by all Dash apps in a process.
+# Figures are stored as serialized JSON under (app, data version, function, arguments), evicted
+# least-recently-used once the stored JSON exceeds CACHE_MAX_BYTES. With CACHE_DIR set, every figure is
+# also written to disk so the cache survives restarts; the disk copy is pruned oldest-first once the bytes written
+# since the last pruning take it over CACHE_MAX_DISK_BYTES, down to PRUNE_TARGET of it.
+
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_DIR = None  # e.g. 'figure_cache' to keep figures across restarts
+CACHE_MAX_DISK_BYTES = 1024 * 1024 * 1024
+PRUNE_TARGET = 0.9  # share of CACHE_MAX_DISK_BYTES left after pruning, so the directory is not listed on every put
+
+
+class FigureCache:
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, cache_dir=CACHE_DIR, max_disk_bytes=CACHE_MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.disk_bytes = 0  # estimate: the size at the last pruning plus what this process wrote since
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.disk_bytes = self.prune_disk()
+
+    def disk_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+        if self.cache_dir and os.path.exists(self.disk_path(key)):
+            with open(self.disk_path(key), 'r') as f:
+                value = f.read()
+            self.put(key, value, write_disk=False)
+            with self.lock:
+                self.hits += 1
+            return value
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value, write_disk=True):
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                self.size -= len(self.entries.popitem(last=False)[1])
+
+        if self.cache_dir and write_disk:
+            path = self.disk_path(key)
+            with open(path + '.tmp', 'w') as f:
+                f.write(value)
+            os.replace(path + '.tmp', path)
+            with self.lock:
+                self.disk_bytes += len(value)
+                prune = self.disk_bytes > self.max_disk_bytes
+            if prune:
+                total = self.prune_disk()
+                with self.lock:
+                    self.disk_bytes = total
+
+    def prune_disk(self):
+        # returns the bytes left on disk
+        files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.json')]
+        files = sorted((os.path.getmtime(path), os.path.getsize(path), path) for path in files)
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_disk_bytes:
+            return total
+        for _, size, path in files:
+            if total <= self.max_disk_bytes * PRUNE_TARGET:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # pruned by another process sharing the directory
+                pass
+            total -= size
+        return total
+
+    def clear(self, app_name=None):
+        # every figure, or only those of one app; figures on disk carry their data version in the key
+        with self.lock:
+            if app_name is None:
+                self.entries.clear()
+                self.size = 0
+                return
+            prefix = json.dumps([app_name])[:-1] + ','
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                self.size -= len(self.entries.pop(key))
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'bytes': self.size}
+
+
+figure_cache = FigureCache()
+
+# load plotly's optional JSON engine now; its lazy import is not safe when figures are first serialized by two threads
+pio.to_json({}, validate=False)
+
+
+def cached_figure(app_name, version=None, cache=None):
+    # memoize a figure function on its (JSON-serializable) arguments; version may be a value or a callable
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            store = cache or figure_cache
+            data_version = version() if callable(version) else version
+            key = json.dumps([app_name, data_version, func.__name__, args])
+
+            figure_json = store.get(key)
+            if figure_json is None:
+                figure = func(*args)
+                with stage(app_name, 'to_json'):
+                    figure_json = pio.to_json(figure, validate=False)
+                store.put(key, figure_json)
+            figure_bytes.observe(len(figure_json), app_name, func.__name__)
+            with stage(app_name, 'from_json'):
+                return json.loads(figure_json)
+        return wrapper
+    return decorator
@@ -0,0 +1,113 @@
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from comention import count_pairs, merge_pairs
+from external_pairs import (GROUP_ROWS, HASH_BUCKETS, group_pairs, merge_partial, read_buckets, spill_mentions,
+                            year_groups)
+from software_names import SoftwareNames
+
+# Approximate top-pair mode of sankey_cal.py (with heavy_hitters): memory of the counting passes is bounded by the
+# number of counters and the batch size instead of the number of distinct pairs.
+#
+# The mentions are spilled to year / doi-hash buckets like external_pairs.py, so every group of buckets holds
+# whole publications. Pass 1 keeps a Misra-Gries summary per year (the mergeable form of Space-Saving) of at
+# most ceil(1 / error) counters: the pair counts of each group are added to the summary and the (size + 1)-th
+# largest counter is subtracted from all counters of the year. A counter ends at most the sum of those cuts below
+# the true count, which is at most error times the pair instances of the year, so every pair with more
+# co-mentions than that bound in some year keeps a counter.
+# Pass 2 counts the candidate pairs exactly in every year. The written counts are exact; a pair is only missing
+# when it stays under the bound in every year, so the top N of a year range is exact whenever its N-th count
+# exceeds the sum of the bounds of those years. The bounds are saved with the pairs, and pair_index.top_pairs
+# leaves out the pairs that a missing one could outrank.
+#
+# Both passes count the pairs of a bucket group in batches of whole publications, so memory is bounded by the
+# pairs of one batch plus the summary (or the candidates), not by the distinct pairs of a year. The spill pass
+# reads the file like every other mode, and its CSV reader is usually the peak of the whole run.
+
+ERROR = 0.0001  # share of a year's pair instances a counter may miss in pass 1
+BATCH_ROWS = 250000  # mentions whose pairs are counted at once
+# a hash key of its own, so batches do not line up with the doi-hash buckets
+BATCH_HASH_KEY = 'heavy_pair_batch'
+
+
+def summary_size(error):
+    return int(np.ceil(1 / error))
+
+
+def shrink(summary, size):
+    # keeps at most size counters per year; returns the summary and the count subtracted in each year
+    rank = summary.groupby('year')['Count'].rank(method='first', ascending=False)
+    cut = summary.loc[(rank == size + 1).to_numpy()].set_index('year')['Count']
+    decrement = summary['year'].map(cut).fillna(0).to_numpy(dtype=np.int64)
+    summary = summary.assign(Count=summary['Count'].to_numpy() - decrement)
+    return summary[summary['Count'] > 0], cut
+
+
+def publication_batches(df, batch_rows):
+    # the mentions in batches of about batch_rows rows, every publication in one batch
+    parts = -(-len(df) // batch_rows)
+    if parts <= 1:
+        return [df]
+    part = pd.util.hash_pandas_object(df['doi'], index=False, hash_key=BATCH_HASH_KEY).to_numpy() % np.uint64(parts)
+    return [df[part == i] for i in range(parts) if (part == i).any()]
+
+
+def candidate_pairs(spill_dir, sizes, years, size, group_rows, names, batch_rows=BATCH_ROWS):
+    # pass 1: the pairs that keep a counter in some year, and the undercount bound of every year
+    candidates, bounds = [], {}
+    for year in years:
+        summary, bounds[year] = None, 0
+        for keys in year_groups(sizes, year, group_rows):
+            for batch in publication_batches(read_buckets(spill_dir, keys), batch_rows):
+                pairs = count_pairs(batch, names=names)
+                summary, cut = shrink(pairs if summary is None else merge_pairs([summary, pairs]), size)
+                bounds[year] += int(cut.sum())
+        candidates.append(summary[['Source', 'Target']])
+    candidates = pd.concat(candidates) if candidates else pd.DataFrame(columns=['Source', 'Target'])
+    return pd.MultiIndex.from_frame(candidates).unique(), pd.Series(bounds, dtype=np.int64, name='bound')
+
+
+def is_candidate(pairs, candidates):
+    return pd.MultiIndex.from_frame(pairs[['Source', 'Target']]).isin(candidates)
+
+
+def recount_pairs(spill_dir, sizes, years, candidates, group_rows, names, batch_rows=BATCH_ROWS):
+    # pass 2: exact per-year counts of the candidate pairs, in count_pairs order
+    pairs = []
+    for year in years:
+        # only the candidates of every batch are kept until the year is merged
+        partial = []
+        for keys in year_groups(sizes, year, group_rows):
+            for batch in publication_batches(read_buckets(spill_dir, keys), batch_rows):
+                batch_pairs = group_pairs(batch, names)
+                partial.append(batch_pairs[is_candidate(batch_pairs, candidates)])
+        year_pairs = merge_partial(partial)
+        pairs.append(year_pairs[['year', 'Count', 'Source', 'Target']])
+    if not pairs:
+        return pd.DataFrame(columns=['year', 'Count', 'Source', 'Target'])
+    return pd.concat(pairs, ignore_index=True)
+
+
+def count_heavy_hitters(spill_dir, sizes, names, error=ERROR, group_rows=GROUP_ROWS, batch_rows=BATCH_ROWS):
+    # both passes over spilled mentions; returns the exact counts of the candidate pairs and the bound per year,
+    # also as the count function of build_aggregates
+    years = sorted({year for year, _ in sizes})
+    candidates, bounds = candidate_pairs(spill_dir, sizes, years, summary_size(error), group_rows, names, batch_rows)
+    print(f'{len(candidates)} candidate pairs, undercount bound over all years: {bounds.sum()}')
+    return recount_pairs(spill_dir, sizes, years, candidates, group_rows, names, batch_rows), bounds
+
+
+def heavy_hitter_pairs(file_path, error=ERROR, group_rows=GROUP_ROWS, hash_buckets=HASH_BUCKETS, spill_dir=None,
+                       names=None, batch_rows=BATCH_ROWS):
+    # returns the exact counts of the candidate pairs, the min / max year and the undercount bound per year
+    names = SoftwareNames() if names is None else names
+    spill_dir = tempfile.mkdtemp(prefix='comention_spill_', dir=spill_dir)
+    try:
+        sizes = spill_mentions(file_path, spill_dir, names, hash_buckets)
+        pairs, bounds = count_heavy_hitters(spill_dir, sizes, names, error, group_rows, batch_rows)
+    finally:
+        shutil.rmtree(spill_dir)
+    years = [year for year, _ in sizes]
+    return pairs, min(years, default=None), max(years, default=None), bounds
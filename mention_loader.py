@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv
+
+# Reading and cleaning of comm_disambiguated.tsv shared by the scripts that parse the raw file.
+# The TSV is parsed by pyarrow's multithreaded CSV reader with explicit column types: text columns as strings,
+# curation_label as a category. Only the requested columns are converted. With chunksize the file is streamed
+# block by block, so memory stays bounded for .gz input as well.
+# The year is the first four characters of pubdate, parsed with pyarrow compute straight into int16;
+# rows whose pubdate does not start with a year are dropped and counted instead of turning the whole
+# column back into strings.
+# With names (a software_names.SoftwareNames table) the cleaned rows also get an int32 software_id column, the
+# column to group and count on; unmapped raw names are matched by their normalized key.
+
+RAW_COLUMNS = ['doi', 'pubdate', 'software', 'curation_label', 'mapped_to_software']
+CATEGORY_COLUMNS = ['curation_label']
+BLOCK_SIZE = 16 * 1024 * 1024  # bytes parsed per block
+
+
+def csv_options(columns):
+    column_types = {column: pa.dictionary(pa.int32(), pa.string()) if column in CATEGORY_COLUMNS else pa.string()
+                    for column in columns}
+    return {
+        'read_options': csv.ReadOptions(block_size=BLOCK_SIZE),
+        'parse_options': csv.ParseOptions(delimiter='\t'),
+        # the same missing-value markers as pd.read_csv, which also knows '<NA>' and 'None'
+        'convert_options': csv.ConvertOptions(column_types=column_types, include_columns=columns,
+                                              strings_can_be_null=True,
+                                              null_values=csv.ConvertOptions().null_values + ['<NA>', 'None']),
+    }
+
+
+def iter_mentions(file_path, columns=RAW_COLUMNS, chunksize=1000000):
+    # DataFrames of chunksize rows (the last one may be shorter), decompressing .gz on the fly
+    reader = csv.open_csv(file_path, **csv_options(columns))
+    table = None
+    for batch in reader:
+        batch = pa.Table.from_batches([batch])
+        table = batch if table is None else pa.concat_tables([table, batch])
+        while table.num_rows >= chunksize:
+            yield table.slice(0, chunksize).to_pandas()
+            table = table.slice(chunksize)
+    if table is not None and table.num_rows:
+        yield table.to_pandas()
+
+
+def read_mentions(file_path, columns=RAW_COLUMNS, nrows=None, chunksize=None):
+    if chunksize is not None:
+        return iter_mentions(file_path, columns, chunksize)
+    if nrows is not None:
+        # stop reading once nrows rows are parsed
+        return next(iter_mentions(file_path, columns, nrows), pd.DataFrame(columns=columns)).head(nrows)
+    return csv.read_csv(file_path, **csv_options(columns)).to_pandas()
+
+
+def parse_year(pubdate):
+    # int16 year and a mask of the rows where pubdate starts with four digits
+    values = pubdate if pubdate.dtype == object else pubdate.astype(str)
+    prefix = pc.utf8_slice_codeunits(pa.array(values, type=pa.string(), from_pandas=True), 0, 4)
+    valid = pc.fill_null(pc.match_substring_regex(prefix, '^[0-9]{4}$'), False)
+    year = pc.cast(pc.if_else(valid, prefix, '0'), pa.int16())
+    return year.to_numpy(zero_copy_only=False), valid.to_numpy(zero_copy_only=False)
+
+
+def fill_software(df):
+    # the raw software name where the mention could not be mapped
+    not_disambiguated = (df['mapped_to_software'] == 'not_disambiguated').to_numpy()
+    return np.where(not_disambiguated, df['software'].to_numpy(), df['mapped_to_software'].to_numpy())
+
+
+def software_ids(df, names):
+    mapped = df['mapped_to_software'].to_numpy()
+    not_disambiguated = mapped == 'not_disambiguated'
+    ids = names.encode(np.where(not_disambiguated, None, mapped))
+    if not_disambiguated.any():
+        ids[not_disambiguated] = names.encode(df['software'].to_numpy()[not_disambiguated], raw=True)
+    return ids
+
+
+def clean_mentions(df, fill_not_disambiguated=False, drop_not_software=True, names=None):
+    # returns the cleaned rows with an int16 year column, and the number of rows dropped per reason
+    dropped = {}
+    if not fill_not_disambiguated:
+        keep = (df['mapped_to_software'] != 'not_disambiguated').to_numpy()
+        dropped['not_disambiguated'] = int((~keep).sum())
+        df = df[keep]
+    elif names is None:
+        df = df.assign(mapped_to_software=fill_software(df))
+    # with names the raw software names are matched in software_id instead
+    if drop_not_software:
+        keep = (df['curation_label'] != 'not_software').to_numpy()
+        dropped['not_software'] = int((~keep).sum())
+        df = df[keep]
+
+    year, valid = parse_year(df['pubdate'])
+    dropped['no_year'] = int((~valid).sum())
+    df = df[valid].assign(year=year[valid])
+    if names is not None:
+        df = df.assign(software_id=software_ids(df, names))
+    return df, pd.Series(dropped, dtype=np.int64)
+
+
+def report_dropped(dropped, total):
+    if not total:
+        print('No rows read')
+        return
+    print(f'Dropped {dropped.sum()} of {total} rows: '
+          + ', '.join(f'{count} {reason}' for reason, count in dropped.items()))
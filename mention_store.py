@@ -0,0 +1,134 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+from mention_loader import parse_year, read_mentions, report_dropped
+
+# One-time ingest of comm_disambiguated.tsv into a Parquet store partitioned by year.
+# The string columns are written as int32 codes against one dictionary shared by all of them,
+# so the dashboards only memory map the columns they need instead of re-parsing the TSV.
+# A build writes into a sibling directory that replaces the store once it is complete, so a rebuild
+# never mixes part files of two builds, and an interrupted one leaves the old store in place.
+
+ROOT_DATA_DIR = r'ROOTPATH'
+
+ENCODED_COLUMNS = ['software', 'mapped_to_software', 'curation_label']
+# the leading underscore keeps the dictionary out of dataset discovery
+DICTIONARY_FILE = '_dictionary.parquet'
+
+YEAR_PARTITIONING = ds.partitioning(pa.schema([('year', pa.int16())]), flavor='hive')
+
+
+def store_path(file_path):
+    # comm_disambiguated.tsv(.gz) -> comm_disambiguated_store
+    return file_path.split('.tsv')[0] + '_store'
+
+
+def encode(values, dictionary):
+    # factorize the chunk locally, then translate the local codes to the shared dictionary
+    local_codes, uniques = pd.factorize(values)
+    for value in uniques:
+        if value not in dictionary:
+            dictionary[value] = len(dictionary)
+    lookup = np.array([dictionary[value] for value in uniques] + [-1], dtype=np.int32)
+    return lookup[local_codes]
+
+
+def build_store(file_path, chunksize=1000000):
+    store_dir = store_path(file_path)
+    build_dir = store_dir + '.tmp'
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+    dictionary = {}
+    total, no_year = 0, 0
+
+    for i, chunk in enumerate(read_mentions(file_path, chunksize=chunksize)):
+        year, valid = parse_year(chunk['pubdate'])
+        # rows without a parseable year can not be placed in a partition
+        total += len(chunk)
+        no_year += int((~valid).sum())
+        chunk = chunk[valid]
+
+        columns = {'doi': pa.array(chunk['doi'], type=pa.string()),
+                   'year': pa.array(year[valid], type=pa.int16())}
+        for column in ENCODED_COLUMNS:
+            codes = encode(chunk[column], dictionary)
+            columns[column] = pa.array(codes, mask=codes < 0)
+
+        ds.write_dataset(
+            pa.table(columns), build_dir,
+            format='parquet',
+            partitioning=YEAR_PARTITIONING,
+            basename_template=f'part-{i}-{{i}}.parquet',
+            existing_data_behavior='overwrite_or_ignore'
+        )
+        print(f'Chunk {i}: {len(chunk)} rows, {len(dictionary)} dictionary entries')
+
+    pq.write_table(pa.table({'value': list(dictionary)}), os.path.join(build_dir, DICTIONARY_FILE))
+    swap_store(build_dir, store_dir)
+    report_dropped(pd.Series({'no_year': no_year}), total)
+    return store_dir
+
+
+def swap_store(build_dir, store_dir):
+    # a directory can not be replaced while it has files, so the old store is moved aside first
+    old_dir = store_dir + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(store_dir):
+        os.replace(store_dir, old_dir)
+    os.replace(build_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def store_version(file_path):
+    # the dictionary is written last, so its modification time changes with every build of the store
+    path = os.path.join(store_path(file_path), DICTIONARY_FILE)
+    return os.path.getmtime(path) if os.path.exists(path) else 0
+
+
+def load_dictionary(store_dir):
+    return pd.Index(pq.read_table(os.path.join(store_dir, DICTIONARY_FILE))['value'].to_pylist())
+
+
+def load_mentions(file_path, columns=None, year_range=None, decode=True):
+    store_dir = store_path(file_path)
+    if not os.path.exists(os.path.join(store_dir, DICTIONARY_FILE)):
+        build_store(file_path)
+
+    dataset = ds.dataset(
+        store_dir,
+        format='parquet',
+        partitioning=YEAR_PARTITIONING,
+        filesystem=fs.LocalFileSystem(use_mmap=True)
+    )
+    year_filter = None
+    if year_range is not None:
+        year_filter = (ds.field('year') >= year_range[0]) & (ds.field('year') <= year_range[1])
+
+    df = dataset.to_table(columns=columns, filter=year_filter).to_pandas()
+
+    if decode:
+        # sorted categories keep groupby/unstack output in the same order as plain string columns
+        dictionary = load_dictionary(store_dir)
+        order = np.argsort(dictionary.to_numpy())
+        rank = np.empty(len(order) + 1, dtype=np.int32)
+        rank[order] = np.arange(len(order))
+        rank[-1] = -1
+        for column in ENCODED_COLUMNS:
+            if column in df.columns:
+                codes = rank[df[column].fillna(-1).astype('int32').to_numpy()]
+                df[column] = pd.Categorical.from_codes(codes, categories=dictionary[order]).remove_unused_categories()
+    return df
+
+
+if __name__ == '__main__':
+    using_sample = 1
+    file_name = '/disambiguated/comm_disambiguated.tsv'
+    if using_sample != 1:
+        file_name = file_name[:-4] + f'_sample{using_sample}.tsv'
+    print(f'Store written to {build_store(ROOT_DATA_DIR + file_name)}')
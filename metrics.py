@@ -0,0 +1,228 @@
+import cProfile
+import functools
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from flask import Response, request
+
+# Callback instrumentation for the Dash apps, exposed in Prometheus text format on /metrics.
+#   dash_callback_seconds{app, callback}     - wall time of every instrumented callback
+#   dash_stage_seconds{app, stage}           - wall time of the named stages inside them (top_pairs, layout, ...)
+#   dash_figure_bytes{app, figure}           - JSON payload of every figure served by cached_figure
+#   dash_callback_peak_bytes{app, callback}  - peak Python allocation during a callback, only with TRACE_MEMORY
+# Metrics live in the process that serves the request; with several gunicorn workers each worker has its own.
+# /metrics only answers requests from the server itself, unless it is started with DASH_PUBLIC_METRICS=1 for a
+# Prometheus server on another host.
+#
+# Request profiling, off unless the server is started with DASH_PROFILING=1, and then only for requests from
+# the server itself: GET /profile?requests=5 profiles the next 5 requests, or send the header X-Profile: 1 with
+# a single request. Reports are written to PROFILE_DIR, as cProfile .prof files or pyinstrument .html pages;
+# only the newest MAX_PROFILES are kept.
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+SIZE_BUCKETS = [1e3, 1e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 5e7]
+TRACE_MEMORY = False  # tracemalloc slows every allocation down, enable only while investigating memory
+PUBLIC_METRICS = os.environ.get('DASH_PUBLIC_METRICS') == '1'
+PROFILING = os.environ.get('DASH_PROFILING') == '1'
+PROFILE_DIR = 'profiles'
+PROFILER = 'cProfile'  # or 'pyinstrument', if installed
+MAX_PROFILES = 50
+LOCAL_ADDRESSES = {'127.0.0.1', '::1'}
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.setdefault(label_values, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for label_values, (counts, total, count) in sorted(self.series.items()):
+                labels = ','.join(f'{label}="{value}"' for label, value in zip(self.labels, label_values))
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound:g}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{labels}}} {total:.6f}')
+                lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+callback_seconds = Histogram('dash_callback_seconds', 'Wall time of Dash callbacks.', ['app', 'callback'],
+                             LATENCY_BUCKETS)
+stage_seconds = Histogram('dash_stage_seconds', 'Wall time of named stages inside callbacks.', ['app', 'stage'],
+                          LATENCY_BUCKETS)
+figure_bytes = Histogram('dash_figure_bytes', 'Serialized figure payload size.', ['app', 'figure'], SIZE_BUCKETS)
+callback_peak_bytes = Histogram('dash_callback_peak_bytes', 'Peak traced allocation during callbacks.',
+                                ['app', 'callback'], SIZE_BUCKETS)
+HISTOGRAMS = [callback_seconds, stage_seconds, figure_bytes, callback_peak_bytes]
+
+if TRACE_MEMORY:
+    tracemalloc.start()
+
+
+@contextmanager
+def stage(app_name, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, app_name, name)
+
+
+def instrumented(app_name):
+    # records the wall time (and with TRACE_MEMORY the peak allocation) of a callback
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            traced = 0
+            if tracemalloc.is_tracing():
+                # the peak is process-wide, concurrent callbacks add to each other's
+                tracemalloc.reset_peak()
+                traced = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                callback_seconds.observe(time.perf_counter() - start, app_name, func.__name__)
+                if tracemalloc.is_tracing():
+                    peak = tracemalloc.get_traced_memory()[1] - traced
+                    callback_peak_bytes.observe(peak, app_name, func.__name__)
+        return wrapper
+    return decorator
+
+
+def process_metrics():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    lines = ['# HELP process_peak_rss_bytes Peak resident set size of the serving process.',
+             '# TYPE process_peak_rss_bytes gauge', f'process_peak_rss_bytes {peak}']
+
+    from figure_cache import figure_cache
+    stats = figure_cache.stats()
+    for key, kind in [('hits', 'counter'), ('misses', 'counter'), ('entries', 'gauge'), ('bytes', 'gauge')]:
+        name = f'dash_figure_cache_{key}' + ('_total' if kind == 'counter' else '')
+        lines += [f'# HELP {name} Figure cache {key}.', f'# TYPE {name} {kind}', f'{name} {stats[key]}']
+    return lines
+
+
+def exposition():
+    lines = process_metrics()
+    for histogram in HISTOGRAMS:
+        lines += histogram.exposition()
+    return '\n'.join(lines) + '\n'
+
+
+class RequestProfiler:
+    # profiles selected requests of a Flask server, one profiler per request thread
+    def __init__(self, profile_dir=PROFILE_DIR, profiler=PROFILER, max_profiles=MAX_PROFILES):
+        self.profile_dir = profile_dir
+        self.profiler = profiler
+        self.max_profiles = max_profiles
+        self.remaining = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def wanted(self, request):
+        if request.remote_addr not in LOCAL_ADDRESSES:
+            return False
+        if request.headers.get('X-Profile') == '1':
+            return True
+        if not request.path.startswith('/_dash-update-component'):
+            return False
+        with self.lock:
+            if self.remaining > 0:
+                self.remaining -= 1
+                return True
+        return False
+
+    def start(self, request):
+        if not self.wanted(request):
+            self.local.profiler = None
+            return
+        if self.profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        self.local.profiler = profiler
+
+    def stop(self):
+        profiler = getattr(self.local, 'profiler', None)
+        if profiler is None:
+            return
+        self.local.profiler = None
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = os.path.join(self.profile_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{time.time_ns() % 10**9:09d}-{threading.get_ident()}')
+        if self.profiler == 'pyinstrument':
+            profiler.stop()
+            with open(name + '.html', 'w') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            profiler.dump_stats(name + '.prof')
+        self.prune()
+
+    def prune(self):
+        # keep the newest max_profiles reports
+        paths = [os.path.join(self.profile_dir, name) for name in os.listdir(self.profile_dir)]
+        for path in sorted(paths, key=os.path.getmtime)[:-self.max_profiles]:
+            os.remove(path)
+
+
+def local_only(what):
+    # the 403 response for requests that do not come from the server itself, None for those that do
+    if request.remote_addr in LOCAL_ADDRESSES:
+        return None
+    return Response(f'{what} only available from the server itself\n', status=403, mimetype='text/plain')
+
+
+def register(server, profiling=PROFILING, public_metrics=PUBLIC_METRICS):
+    # adds /metrics, and with profiling /profile, to the Flask server of a Dash app
+    @server.route('/metrics')
+    def metrics():
+        forbidden = None if public_metrics else local_only('Metrics are')
+        return forbidden or Response(exposition(), mimetype='text/plain; version=0.0.4')
+
+    if not profiling:
+        return server
+    profiler = RequestProfiler()
+
+    @server.route('/profile')
+    def profile():
+        forbidden = local_only('Profiling is')
+        if forbidden:
+            return forbidden
+        with profiler.lock:
+            profiler.remaining = min(int(request.args.get('requests', 1)), profiler.max_profiles)
+        return Response(f'Profiling the next {profiler.remaining} callback requests into {profiler.profile_dir}\n',
+                        mimetype='text/plain')
+
+    server.before_request(lambda: profiler.start(request))
+
+    @server.after_request
+    def stop_profiler(response):
+        profiler.stop()
+        return response
+
+    return server
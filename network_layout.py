@@ -0,0 +1,75 @@
+import threading
+
+import numpy as np
+
+# Stable node positions for the network animation, keyed by software name.
+# The first graph gets a full layout; every later graph starts from the positions its nodes had last time
+# (new nodes are placed next to their already placed neighbours) and only runs a short, cool
+# Fruchterman-Reingold refinement, so frames are cheaper and nodes do not jump between them.
+# Layouts can also be computed ahead for a whole animation and stored per frame key.
+
+REFINE_ITERATIONS = 50
+REFINE_TEMPERATURE = 0.2  # start temperature of the refinement, as a fraction of the full layout's default
+NEW_NODE_JITTER = 0.5
+
+
+class LayoutCache:
+    def __init__(self, seed=0):
+        self.positions = {}
+        self.frames = {}
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+
+    def seed_layout(self, G, names):
+        coords = np.array([self.positions.get(name, (np.nan, np.nan)) for name in names], dtype=float).reshape(-1, 2)
+        placed = ~np.isnan(coords[:, 0])
+        center = coords[placed].mean(axis=0)
+
+        # a new node starts at the mean of its placed neighbours, or near the centre when it has none
+        for vertex in np.flatnonzero(~placed):
+            neighbours = [v for v in G.neighbors(vertex) if placed[v]]
+            anchor = coords[neighbours].mean(axis=0) if neighbours else center
+            coords[vertex] = anchor + self.rng.normal(scale=NEW_NODE_JITTER, size=2)
+        return coords
+
+    def align(self, coords, seed, placed):
+        # igraph may return the refined layout rotated or mirrored; undo that against the placed nodes
+        if placed.sum() < 2:
+            return coords
+        mean, seed_mean = coords[placed].mean(axis=0), seed[placed].mean(axis=0)
+        u, _, vt = np.linalg.svd((coords[placed] - mean).T @ (seed[placed] - seed_mean))
+        return (coords - mean) @ (u @ vt) + seed_mean
+
+    def layout(self, G, key=None):
+        # G needs a 'name' vertex attribute; returns an (n, 2) array of positions
+        names = G.vs['name']
+        if key is not None and key in self.frames:
+            return np.array([self.frames[key][name] for name in names], dtype=float).reshape(-1, 2)
+
+        with self.lock:
+            if not any(name in self.positions for name in names):
+                coords = np.array(G.layout('auto').coords, dtype=float).reshape(-1, 2)
+            else:
+                placed = np.array([name in self.positions for name in names])
+                seed = self.seed_layout(G, names)
+                start_temp = np.sqrt(G.vcount()) / 10 * REFINE_TEMPERATURE
+                coords = np.array(G.layout_fruchterman_reingold(
+                    seed=seed.tolist(), niter=REFINE_ITERATIONS, start_temp=start_temp,
+                ).coords, dtype=float).reshape(-1, 2)
+                coords = self.align(coords, seed, placed)
+
+            positions = dict(zip(names, map(tuple, coords)))
+            self.positions.update(positions)
+            if key is not None:
+                self.frames[key] = positions
+        return coords
+
+    def precompute(self, frames):
+        # frames is an ordered iterable of (key, graph), e.g. every year of an animation
+        for key, G in frames:
+            self.layout(G, key)
+
+    def clear(self):
+        with self.lock:
+            self.positions.clear()
+            self.frames.clear()
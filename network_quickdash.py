@@ -1,22 +1,36 @@
 import dash
-from dash import dcc, html
+from dash import callback, clientside_callback, dcc, html
 from dash.dependencies import Input, Output, State
 import pandas as pd
 import plotly.graph_objects as go
-import json
+from animation import AnimationBuilder, animation_figure, autoplay_script
+from build_aggregates import aggregates_version
+from data_reload import watch_data
+from figure_cache import cached_figure, figure_cache
+from metrics import instrumented, register, stage
+from network_layout import LayoutCache
+from pair_index import load_pair_index, range_bound, top_pairs
+from payload import fit_budget
 import numpy as np
 import igraph as ig
 
-app = dash.Dash(__name__)
+# Read the precomputed cumulative pair counts, built from sankey_data.arrow if sankey_cal.py did not write them,
+# and swap in the new ones whenever build_aggregates.py or append_batch.py writes a new version
+pair_data = watch_data('pair_index', lambda: load_pair_index('sankey_index', 'sankey_data.arrow'),
+                       lambda: aggregates_version('sankey_index', 'sankey_data.arrow'))
 
-# Read the precomputed Sankey data
-with open('sankey_data.json', 'r') as f:
-    sankey_data = json.load(f)
+min_year, max_year = (int(year) for year in pair_data.get()['years'])
 
-min_year = min(map(int, sankey_data.keys()))
-max_year = max(map(int, sankey_data.keys()))
+EDGE_BUCKETS = 10  # edges are drawn as one trace per weight bucket
+PRECOMPUTE_FRAMES = True  # lay out every frame of the animation when Play is pressed
+CLIENT_ANIMATION = True  # send all frames to the browser at once instead of one server update per interval
+PREBUILD_ANIMATION = False  # with CLIENT_ANIMATION, build the animation of every selection in the background
+PAYLOAD_BUDGET = None  # bytes per figure, e.g. 200000: rounded coordinates, hover templates, fewer edges if over
 
-def create_network(connections_df, selected_N, year_range):
+# Node positions are kept by software name, so consecutive frames only refine the previous layout
+layout_cache = LayoutCache()
+
+def build_graph(connections_df, selected_N):
     # Ensure the 'Count' column is of numeric type
     connections_df['Count'] = pd.to_numeric(connections_df['Count'], errors='coerce')
     
@@ -25,123 +39,115 @@ def create_network(connections_df, selected_N, year_range):
     
     top_connections = connections_df.nlargest(selected_N, 'Count')
     
-    # Create a directed graph
-    G = ig.Graph(directed=True)
-    
-    all_nodes = pd.concat([top_connections['Source'], top_connections['Target']]).unique()
-    G.add_vertices(all_nodes)
-    
-    for index, row in top_connections.iterrows():
-        G.add_edge(row['Source'], row['Target'], weight=row['Count'])
-   
-    # Compute the layout of the graph
-    layout = G.layout('auto') # Kamada-Kawai layout
-    
-    # Extract node positions from the layout
-    node_x = [pos[0] for pos in layout.coords]
-    node_y = [pos[1] for pos in layout.coords]
-    
-    # Compute the size of nodes based on the total connection count
-    node_sizes = []
-    node_labels = []
+    # Create a directed graph from integer-coded edges
+    codes, all_nodes = pd.factorize(pd.concat([top_connections['Source'], top_connections['Target']]))
+    edge_source, edge_target = codes[:len(top_connections)], codes[len(top_connections):]
+    weights = top_connections['Count'].to_numpy()
+
+    G = ig.Graph(n=len(all_nodes), directed=True, vertex_attrs={'name': list(all_nodes)})
+    G.add_edges(np.column_stack([edge_source, edge_target]).tolist(), attributes={'weight': weights.tolist()})
+    return G, edge_source, edge_target, weights
+
+def create_network(connections_df, selected_N, year_range):
+    with stage('network', 'build_graph'):
+        G, edge_source, edge_target, weights = build_graph(connections_df, selected_N)
+    all_nodes = G.vs['name']
+
+    # Compute the layout of the graph, starting from the positions of the previous frame
+    with stage('network', 'layout'):
+        coords = layout_cache.layout(G, key=(selected_N, *year_range))
+    node_x, node_y = coords[:, 0], coords[:, 1]
+
+    # Compute the size of nodes based on the total connection count (in + out edge weights)
+    total_weights = np.array(G.strength(mode='all', weights='weight')).astype(weights.dtype)
+    node_sizes = np.sqrt(total_weights) * 0.2  # Adjust size multiplier as needed
+    node_degrees = np.array(G.degree())
+
     limit = 75 # Set a limit on the number of nodes to label
-    for node in G.vs:
-        in_edges = G.es.select(_target_in=[node.index])
-        out_edges = G.es.select(_source_in=[node.index])
-        total_weight = sum(in_edges['weight']) + sum(out_edges['weight'])
-        node_sizes.append(np.sqrt(total_weight) * 0.2)  # Adjust size multiplier as needed
-        if len(node_labels) < limit:
-            node_labels.append(node['name'])
-        else:
-            node_labels.append('')
+    node_labels = np.where(np.arange(len(all_nodes)) < limit, np.asarray(all_nodes, dtype=object), '')
 
     label_trace = go.Scatter(
         x=node_x, y=node_y,
+        ids=all_nodes,
         text=node_labels,
         textposition="top center",
         mode='text',
         hoverinfo='none'
     )
-    
+
+    if PAYLOAD_BUDGET is None:
+        node_text = (pd.Series(all_nodes, dtype=object) + '<br># of connections: ' + pd.Series(node_degrees).astype(str)
+                     + '<br>Total connections: ' + pd.Series(total_weights).astype(str))
+        node_hover = dict(hoverinfo='text', text=node_text.to_numpy())
+    else:
+        # the browser formats the same text from numbers the figure carries anyway
+        node_hover = dict(customdata=np.column_stack([node_degrees, total_weights]),
+                          hovertemplate='%{id}<br># of connections: %{customdata[0]}'
+                                        '<br>Total connections: %{customdata[1]}<extra></extra>')
+
     node_trace = go.Scatter(
         x=node_x, y=node_y,
+        ids=all_nodes,
         mode='markers',
-        hoverinfo='text',
+        **node_hover,
         marker=dict(
             showscale=True,
             colorscale='Burg',
             size=node_sizes,  # Set node sizes based on total connection count
+            color=node_degrees,
+            cmin=node_degrees.min(),
+            cmax=node_degrees.max(),
             colorbar=dict(
                 thickness=15,
                 title='Connections',
                 xanchor='left',
-                titleside='right'
+                titleside='right',
+                tickvals=[node_degrees.min(), node_degrees.max()],
+                ticktext=[node_degrees.min(), node_degrees.max()]
             )
         )
     )
 
-    # Calculate the degree of each node
-    node_degrees = np.array(G.degree())
-
-    node_trace.marker.color = node_degrees
-    node_trace.marker.cmin = min(node_degrees)
-    node_trace.marker.cmax = max(node_degrees)
-    node_trace.marker.colorbar.title = 'Connections'
-    node_trace.marker.colorbar.tickvals = [min(node_degrees), max(node_degrees)]
-    node_trace.marker.colorbar.ticktext = [min(node_degrees), max(node_degrees)]
-    
-    node_text = []
-    for node in G.vs:
-        node_text.append(f'{node["name"]}<br># of connections: {G.degree(node.index)}<br>Total connections: {sum(G.es.select(_source_in=[node.index])["weight"]) + sum(G.es.select(_target_in=[node.index])["weight"])}')
-    
-    node_trace.text = node_text
-    
     # Normalize edge weights to range [0, 1]
-    edge_weights = np.array(G.es['weight'])
-    edge_weight_range = max(edge_weights) - min(edge_weights)
-    normalized_weights = (edge_weights - min(edge_weights)) / (edge_weight_range if edge_weight_range != 0 else 1)
+    edge_weight_range = weights.max() - weights.min()
+    normalized_weights = (weights - weights.min()) / (edge_weight_range if edge_weight_range != 0 else 1)
 
     min_alpha = 0.1  # Set minimum alpha for visibility
     alpha_range = 0.7  # Set the range of alpha values, min 0.1 / max 0.8
-    
+
+    # Draw the edges as one trace per weight bucket instead of one trace per edge;
+    # segments within a trace are separated by None
+    buckets = np.minimum((normalized_weights * EDGE_BUCKETS).astype(int), EDGE_BUCKETS - 1)
     traces = []  # List to store all the traces
-    
-    for edge, weight in zip(G.es, normalized_weights):
-        source_idx, target_idx = edge.tuple
-        edge_x = [layout.coords[source_idx][0], layout.coords[target_idx][0]]
-        edge_y = [layout.coords[source_idx][1], layout.coords[target_idx][1]]
-        
+
+    for bucket in range(EDGE_BUCKETS):  # a fixed number of traces, so animation frames line up
+        edges = np.flatnonzero(buckets == bucket)
+        weight = (bucket + 0.5) / EDGE_BUCKETS
+
         alpha = min_alpha + alpha_range * weight  # Ensure a minimum alpha for visibility
         thickness = 1 + 9 * weight  # Adjust thickness based on weight, e.g., from 1 to 10
-        
-        # Create a trace for each edge
-        edge_trace = go.Scatter(
+
+        gaps = np.full(len(edges), None)
+        edge_x = np.column_stack([node_x[edge_source[edges]], node_x[edge_target[edges]], gaps]).ravel()
+        edge_y = np.column_stack([node_y[edge_source[edges]], node_y[edge_target[edges]], gaps]).ravel()
+
+        traces.append(go.Scatter(
             x=edge_x, y=edge_y,
             line=dict(width=thickness, color=f'rgba(0, 0, 0, {alpha})'),
-            hoverinfo='text',
-            text=f'Connections: {edge["weight"]}',  # Hover text
+            hoverinfo='skip',
             mode='lines'
-        )
-        
-        traces.append(edge_trace)
-
-    hover_x = []
-    hover_y = []
-    hover_text = []
-    for edge, weight in zip(G.es, edge_weights):
-        source_idx, target_idx = edge.tuple
-        x0, y0 = layout.coords[source_idx]
-        x1, y1 = layout.coords[target_idx]
-        hover_x.append((x0 + x1) / 2)
-        hover_y.append((y0 + y1) / 2)
-        hover_text.append(f'Connections: {edge["weight"]}')
+        ))
 
     # Creating a trace for edge hover points
+    if PAYLOAD_BUDGET is None:
+        edge_hover = dict(hoverinfo='text', text=('Connections: ' + pd.Series(weights).astype(str)).to_numpy())
+    else:
+        edge_hover = dict(customdata=weights, hovertemplate='Connections: %{customdata}<extra></extra>')
     hover_trace = go.Scatter(
-        x=hover_x, y=hover_y,
-        text=hover_text,
+        x=(node_x[edge_source] + node_x[edge_target]) / 2,
+        y=(node_y[edge_source] + node_y[edge_target]) / 2,
         mode='markers',
-        hoverinfo='text',
+        **edge_hover,
         marker=dict(color='rgba(0,0,0,0)', size=5),
     )
 
@@ -169,59 +175,144 @@ def create_network(connections_df, selected_N, year_range):
                 )
     return fig
 
-@app.callback(
-    Output('software-connections', 'figure'),
-    [Input('n-selector', 'value'),
-     Input('year-slider', 'value')]
+@cached_figure('network', version=pair_data.version)
+def network_figure(selected_N, year_range):
+    index = pair_data.get()
+    with stage('network', 'top_pairs'):
+        combined_connections = top_pairs(index, year_range, selected_N)
+    if PAYLOAD_BUDGET is None:
+        figure = create_network(combined_connections, selected_N, year_range)
+    else:
+        # the heaviest connections that fit the budget
+        with stage('network', 'fit_budget'):
+            figure, n_edges, _ = fit_budget(lambda n: create_network(combined_connections, n, year_range),
+                                            len(combined_connections), PAYLOAD_BUDGET)
+        if n_edges < len(combined_connections):
+            figure['layout']['annotations'][0]['text'] += (f'<br>Top {n_edges} of {len(combined_connections)} '
+                                                           f'connections')
+    bound = range_bound(index, year_range)
+    if bound:
+        figure['layout']['annotations'][0]['text'] += f'<br>Approximate: connections of {bound} or fewer not shown'
+    return figure
+
+def build_animation(selected_N, year_range):
+    # every frame from the selected range to the last year, with the layouts computed in frame order
+    last_year = int(pair_data.get()['years'][1])
+    end_years = range(year_range[1], last_year + 1)
+    precompute_animation(selected_N, year_range, last_year)
+    figures = [network_figure(selected_N, [year_range[0], end_year]) for end_year in end_years]
+    with stage('network', 'animation_figure'):
+        return animation_figure(figures, end_years, redraw=True)
+
+animations = AnimationBuilder(build_animation)
+
+def reset_caches():
+    # figures, animations and layouts of the previous data version are never requested again
+    figure_cache.clear('network')
+    animations.clear()
+    layout_cache.clear()
+
+pair_data.subscribe(reset_caches)
+
+@callback(
+    Output('network-software-connections', 'figure'),
+    [Input('network-n-selector', 'value'),
+     Input('network-year-slider', 'value')]
 )
+@instrumented('network')
 def update_graph(selected_N, year_range):
-    combined_connections = pd.DataFrame(columns=['Source', 'Target', 'Count'])
-    
-    for year in range(year_range[0], year_range[1] + 1):
-        year_str = str(year)
-        if year_str in sankey_data:
-            year_connections = pd.DataFrame(sankey_data[year_str])
-            combined_connections = pd.concat([combined_connections, year_connections])
-    
-    combined_connections = combined_connections.groupby(['Source', 'Target'], as_index=False).sum()
-    return create_network(combined_connections, selected_N, year_range)
+    if CLIENT_ANIMATION and PREBUILD_ANIMATION:
+        # start building the animation for this selection while the user looks at it
+        animations.submit(selected_N, tuple(year_range))
+    return network_figure(selected_N, year_range)
+
+@callback(
+    Output('network-software-connections', 'figure', allow_duplicate=True),
+    Input('network-play-button', 'n_clicks'),
+    State('network-n-selector', 'value'),
+    State('network-year-slider', 'value'),
+    prevent_initial_call=True,
+)
+@instrumented('network')
+def play_client_animation(n_clicks, selected_N, year_range):
+    if not CLIENT_ANIMATION:
+        raise dash.exceptions.PreventUpdate
+    return animations.get(selected_N, tuple(year_range))
+
+clientside_callback(
+    autoplay_script('network-software-connections', redraw=True),
+    Output('network-animation-frames', 'data'),
+    Input('network-software-connections', 'figure'),
+)
+
+# Connections of a node, sent only when it is clicked instead of with every figure
+@callback(
+    Output('network-details', 'children'),
+    Input('network-software-connections', 'clickData'),
+    State('network-n-selector', 'value'),
+    State('network-year-slider', 'value'),
+)
+@instrumented('network')
+def show_details(click_data, selected_N, year_range):
+    if not click_data or 'id' not in click_data['points'][0]:
+        raise dash.exceptions.PreventUpdate
+    name = click_data['points'][0]['id']
+    connections = top_pairs(pair_data.get(), year_range, selected_N)
+    connections = connections[(connections['Source'] == name) | (connections['Target'] == name)]
+    others = connections['Target'].where(connections['Source'] == name, connections['Source'])
+    return [html.H6(f'{name}: {len(connections)} connections, {int(connections["Count"].sum())} in total',
+                    style={'marginBottom': 5}),
+            html.Ul([html.Li(f'{other}: {count}') for other, count in zip(others, connections['Count'])])]
+
+def precompute_animation(selected_N, year_range, last_year):
+    # lay out the frames update_slider will step through, in order, so each one refines the one before
+    layout_cache.precompute(
+        ((selected_N, year_range[0], end_year),
+         build_graph(top_pairs(pair_data.get(), [year_range[0], end_year], selected_N), selected_N)[0])
+        for end_year in range(year_range[1], last_year + 1))
 
 # Play/pause animation callback
-@app.callback(
-    [Output('interval-component', 'disabled'),
-     Output('play-button', 'children')],
-    Input('play-button', 'n_clicks'),
-    State('interval-component', 'disabled'),
+@callback(
+    [Output('network-interval-component', 'disabled'),
+     Output('network-play-button', 'children')],
+    Input('network-play-button', 'n_clicks'),
+    State('network-interval-component', 'disabled'),
+    State('network-n-selector', 'value'),
+    State('network-year-slider', 'value'),
 )
-def play_pause_animation(n_clicks, is_disabled):
-    if n_clicks is None or n_clicks == 0:
+@instrumented('network')
+def play_pause_animation(n_clicks, is_disabled, selected_N, year_range):
+    if n_clicks is None or n_clicks == 0 or CLIENT_ANIMATION:
         # On initial load, don't update anything
         raise dash.exceptions.PreventUpdate
     # Toggle the 'disabled' property of the interval component
     new_disabled_state = not is_disabled
+    if PRECOMPUTE_FRAMES and not new_disabled_state:
+        precompute_animation(selected_N, year_range, int(pair_data.get()['years'][1]))
     # Set button label to "Play" if the animation will be stopped, and "Stop" if it will be running
     button_label = "Play" if new_disabled_state else "Stop"
     return new_disabled_state, button_label
 
-@app.callback(
-    Output('year-slider', 'value'),
-    Input('interval-component', 'n_intervals'),
-    State('year-slider', 'value'),
+@callback(
+    Output('network-year-slider', 'value'),
+    Input('network-interval-component', 'n_intervals'),
+    State('network-year-slider', 'value'),
 )
+@instrumented('network')
 def update_slider(n_intervals, current_year_range):
-    max_year = 2021  # Replace with your max year
-    if current_year_range[1] < max_year:
+    last_year = int(pair_data.get()['years'][1])
+    if current_year_range[1] < last_year:
         return [current_year_range[0], current_year_range[1] + 1]
     else:
-        return [current_year_range[0], max_year]
+        return [current_year_range[0], last_year]
 
 # Dash app layout
-app.layout = html.Div([
+layout = html.Div([
     html.Div([
         html.Div([
             html.H6('Most Mentioned Software:', style={'marginBottom': 5, 'marginTop': 0}),
             dcc.Dropdown(
-                id='n-selector',
+                id='network-n-selector',
                 options=[
                     {'label': 'Top 5', 'value': 5},
                     {'label': 'Top 10', 'value': 10},
@@ -237,28 +328,33 @@ app.layout = html.Div([
 
     html.Div([
         dcc.RangeSlider(
-            id='year-slider',
+            id='network-year-slider',
             min=1990,
-            max=2021,
+            max=max_year,
             step=1,
-            marks={i: str(i) for i in range(1990, 2021 + 1, 5)},
+            marks={i: str(i) for i in range(1990, max_year + 1, 5)},
             value=[1995, max_year]  # default value
         )
     ], style={'padding': '10px', 'boxShadow': '0px 0px 5px #ccc', 'borderRadius': '5px', 'marginBottom': '20px'}),
 
-    html.Button('Play', id='play-button', n_clicks=0),
+    html.Button('Play', id='network-play-button', n_clicks=0),
+    dcc.Store(id='network-animation-frames'),
     dcc.Interval(
-        id='interval-component',
+        id='network-interval-component',
         interval=5*1000,  # in milliseconds
         n_intervals=0,
         disabled=True,  # disabled on start
     ),
 
     dcc.Graph(
-        id='software-connections',
+        id='network-software-connections',
         style={'height': '70vh'}  # Set the height of the graph
     ),
+    html.Div(id='network-details', style={'padding': '10px'}),
 ], style={'padding': '10px', 'height': '100vh', 'margin': '0'})
 
 if __name__ == '__main__':
+    app = dash.Dash(__name__)
+    app.layout = layout
+    register(app.server)
     app.run_server(debug=False, port=8052)
@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sankey_store import encode_names, read_sankey_file, read_sankey_json, take_names
+
+# Cumulative-by-year index of co-mention pair counts, written by sankey_cal.py next to sankey_data.arrow.
+#
+# Every pair (source, target) gets an id in (Source, Target) order. For each year a pair occurs in,
+# entry_cum holds its running total up to that year; entries are sorted by (pair, year) and located by
+# entry_key = pair * span + (year - min_year). The count of all pairs over [y0, y1] is then
+# cumulative(y1) - cumulative(y0 - 1), two vectorized lookups instead of a concat/groupby per year.
+# bounds holds the per-year undercount bound of heavy-hitter counts (heavy_pairs.py), zeros for exact counts.
+# names is an Arrow string array, saved as its offsets and utf-8 bytes so that loading it is a memory map too.
+
+INDEX_ARRAYS = ['names', 'source', 'target', 'entry_key', 'entry_cum', 'years', 'bounds']
+
+
+def year_bounds(bounds, min_year, max_year):
+    # {year: bound} as one int64 per year of the index
+    years = np.arange(min_year, max_year + 1)
+    return np.array([(bounds or {}).get(int(year), 0) for year in years], dtype=np.int64)
+
+
+def build_pair_index(names, year, source, target, count, min_year, max_year, bounds=None):
+    # names is a sorted Arrow string array and source/target are codes into it, so code order is name order
+    n = len(names)
+    # pair ids sorted by (source, target), the order groupby(['Source', 'Target']) produces
+    pair, pair_keys = pd.factorize(np.asarray(source, dtype=np.int64) * n + np.asarray(target), sort=True)
+    span = max_year - min_year + 1
+
+    entries = pd.Series(np.asarray(count, dtype=np.int64)).groupby(
+        pair.astype(np.int64) * span + (np.asarray(year, dtype=np.int64) - min_year)).sum()
+    entry_key = entries.index.to_numpy()
+    entry_cum = entries.to_numpy().cumsum()
+
+    # restart the running total at the first entry of every pair
+    entry_pair = entry_key // span
+    first = np.flatnonzero(np.r_[True, entry_pair[1:] != entry_pair[:-1]])
+    before = np.r_[0, entry_cum][first]
+    entry_cum = entry_cum - np.repeat(before, np.diff(np.r_[first, len(entry_cum)]))
+
+    return {
+        'names': names,
+        'source': (pair_keys // n).astype(np.int32),
+        'target': (pair_keys % n).astype(np.int32),
+        'entry_key': entry_key,
+        'entry_cum': entry_cum,
+        'years': np.array([min_year, max_year], dtype=np.int64),
+        'bounds': year_bounds(bounds, min_year, max_year),
+    }
+
+
+def index_from_pairs(pairs, min_year, max_year, bounds=None):
+    source, target, names = encode_names(pairs)
+    return build_pair_index(names, pairs['year'], source, target, pairs['Count'], min_year, max_year, bounds)
+
+
+def index_from_sankey_file(data):
+    return build_pair_index(data['names'], data['year'], data['source'], data['target'], data['count'],
+                            *data['years'], data['bounds'])
+
+
+def string_buffers(names):
+    # the offsets and utf-8 bytes of an Arrow string array, rebased to start at 0
+    if len(names) == 0:
+        return np.zeros(1, dtype=np.int32), np.zeros(0, dtype=np.uint8)
+    _, offsets, data = names.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int32)[names.offset:names.offset + len(names) + 1]
+    data = np.frombuffer(data, dtype=np.uint8)[offsets[0]:offsets[-1]]
+    return offsets - offsets[0], data
+
+
+def save_pair_index(index, index_dir):
+    # every array replaces its file instead of overwriting it, so running apps keep their mapped copy intact
+    os.makedirs(index_dir, exist_ok=True)
+    arrays = {name: index[name] for name in INDEX_ARRAYS if name != 'names'}
+    arrays['names_offsets'], arrays['names_data'] = string_buffers(index['names'])
+    for name, values in arrays.items():
+        path = os.path.join(index_dir, name + '.npy')
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, values)
+        os.replace(path + '.tmp', path)
+
+
+def load_index_names(index_dir):
+    # the names as an Arrow string array over the mapped offsets and bytes
+    if not os.path.exists(os.path.join(index_dir, 'names_offsets.npy')):
+        # indexes written before the names were saved as offsets and bytes hold a fixed-width array
+        return pa.array(np.load(os.path.join(index_dir, 'names.npy')).tolist(), type=pa.string())
+    offsets = np.load(os.path.join(index_dir, 'names_offsets.npy'), mmap_mode='r')
+    data = np.load(os.path.join(index_dir, 'names_data.npy'), mmap_mode='r')
+    return pa.StringArray.from_buffers(len(offsets) - 1, pa.py_buffer(offsets), pa.py_buffer(data))
+
+
+def load_pair_index(index_dir, sankey_path=None):
+    # memory map the saved arrays; fall back to building the index from sankey_data.arrow or .json
+    if os.path.isdir(index_dir) or sankey_path is None:
+        index = {name: np.load(os.path.join(index_dir, name + '.npy'), mmap_mode='r') for name in INDEX_ARRAYS
+                 if name != 'names' and (name != 'bounds' or os.path.exists(os.path.join(index_dir, 'bounds.npy')))}
+        index['names'] = load_index_names(index_dir)
+        # indexes written before the bounds were kept hold exact counts
+        index.setdefault('bounds', year_bounds(None, *(int(year) for year in index['years'])))
+        return index
+    if sankey_path.endswith('.json'):
+        return index_from_pairs(*read_sankey_json(sankey_path))
+    return index_from_sankey_file(read_sankey_file(sankey_path))
+
+
+def cumulative_counts(index, year):
+    # running total of every pair up to and including year
+    min_year, max_year = (int(y) for y in index['years'])
+    pairs = np.arange(len(index['source']))
+    if year < min_year or len(index['entry_key']) == 0:
+        return np.zeros(len(pairs), dtype=np.int64)
+
+    span = max_year - min_year + 1
+    last = np.searchsorted(index['entry_key'], pairs * span + (min(year, max_year) - min_year), side='right') - 1
+    found = (last >= 0) & (index['entry_key'][np.maximum(last, 0)] // span == pairs)
+    return np.where(found, index['entry_cum'][np.maximum(last, 0)], 0)
+
+
+def range_counts(index, year_range):
+    return cumulative_counts(index, year_range[1]) - cumulative_counts(index, year_range[0] - 1)
+
+
+def range_bound(index, year_range):
+    # most co-mentions a pair missing from heavy-hitter counts can have over the range, 0 for exact counts
+    min_year, max_year = (int(y) for y in index['years'])
+    start, end = max(year_range[0], min_year) - min_year, min(year_range[1], max_year) - min_year + 1
+    return int(np.asarray(index['bounds'][start:max(start, end)]).sum())
+
+
+def top_pairs(index, year_range, selected_N):
+    counts = range_counts(index, year_range)
+    # with approximate counts only the pairs above the bound are certainly in the top N
+    counts = np.where(counts > range_bound(index, year_range), counts, 0)
+    present = np.flatnonzero(counts)
+
+    # argpartition-style threshold, then ties in (Source, Target) order like DataFrame.nlargest
+    if len(present) > selected_N:
+        kth = np.partition(counts[present], len(present) - selected_N)[len(present) - selected_N]
+        present = present[counts[present] >= kth]
+    top = present[np.lexsort((present, -counts[present]))][:selected_N]
+
+    return pd.DataFrame({
+        'Source': take_names(index['names'], index['source'][top]),
+        'Target': take_names(index['names'], index['target'][top]),
+        'Count': counts[top],
+    })
@@ -0,0 +1,81 @@
+import base64
+
+import numpy as np
+import plotly.io as pio
+
+# Payload budget for the figures of network_quickdash.py and sankey_quickdash.py (PAYLOAD_BUDGET in each app).
+#   - float arrays are rounded to COORDINATE_DECIMALS digits, which is far below a pixel for layout coordinates
+#   - with TYPED_ARRAYS numeric arrays are sent as base64 typed arrays ({'dtype': ..., 'bdata': ...}); plotly.js
+#     decodes them from version 2.28 on, Dash 2.14 bundles 2.24, so this needs a newer Dash or plotly.js
+#   - a figure still over budget is rebuilt from fewer of its heaviest edges (fit_budget)
+# The apps also switch to hover templates over numeric customdata, so no per-point hover strings are sent.
+# Payload sizes are recorded per figure in dash_figure_bytes on /metrics (metrics.py).
+
+COORDINATE_DECIMALS = 3
+TYPED_ARRAYS = False
+# numeric arrays of the traces the apps draw, as paths into the trace
+NUMERIC_PATHS = [('x',), ('y',), ('customdata',), ('marker', 'size'), ('marker', 'color'), ('link', 'source'),
+                 ('link', 'target'), ('link', 'value')]
+TYPED_DTYPES = {'f': 'f4', 'i': 'i4', 'u': 'u4'}
+
+
+def typed_array(values):
+    dtype = TYPED_DTYPES[values.dtype.kind]
+    return {'dtype': dtype, 'bdata': base64.b64encode(values.astype(dtype).tobytes()).decode()}
+
+
+def compact_array(values, decimals=COORDINATE_DECIMALS, typed=TYPED_ARRAYS):
+    # None gaps between line segments become NaN, which plotly.js also draws as a gap
+    array = np.asarray(values)
+    if array.dtype == object:
+        try:
+            array = array.astype(float)
+        except (TypeError, ValueError):
+            return values
+    if array.dtype.kind not in TYPED_DTYPES:
+        return values
+    if array.dtype.kind == 'f':
+        array = array.round(decimals)
+    if typed and array.ndim == 1:
+        return typed_array(array)
+    # JSON has no NaN, send the gaps as null again
+    if array.dtype.kind == 'f' and np.isnan(array).any():
+        return np.where(np.isnan(array), None, array)
+    return array
+
+
+def compact_trace(trace, decimals, typed):
+    for path in NUMERIC_PATHS:
+        parent = trace
+        for key in path[:-1]:
+            parent = parent.get(key) if isinstance(parent, dict) else None
+        if isinstance(parent, dict) and isinstance(parent.get(path[-1]), (list, tuple, np.ndarray)):
+            parent[path[-1]] = compact_array(parent[path[-1]], decimals, typed)
+    return trace
+
+
+def compact_figure(figure, decimals=COORDINATE_DECIMALS, typed=TYPED_ARRAYS):
+    # figure as a dict, with the numeric arrays of its traces and animation frames compacted
+    figure = figure.to_plotly_json() if hasattr(figure, 'to_plotly_json') else figure
+    for trace in figure.get('data', []):
+        compact_trace(trace, decimals, typed)
+    for frame in figure.get('frames', []):
+        for trace in frame.get('data', []):
+            compact_trace(trace, decimals, typed)
+    return figure
+
+
+def payload_size(figure):
+    return len(pio.to_json(figure, validate=False))
+
+
+def fit_budget(build, n_items, budget):
+    # build(n) draws the n heaviest items; returns the compacted figure of the most items that fit the budget,
+    # how many items it draws, and its size. The size is close to linear in the items, so one or two rebuilds do.
+    figure = compact_figure(build(n_items))
+    size = payload_size(figure)
+    while size > budget and n_items > 1:
+        n_items = max(1, min(n_items - 1, int(n_items * budget / size * 0.95)))
+        figure = compact_figure(build(n_items))
+        size = payload_size(figure)
+    return figure, n_items, size
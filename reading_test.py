@@ -1,5 +1,6 @@
 import pandas as pd
 import json
+from mention_store import load_mentions
 
 # force print all
 pd.set_option('display.max_seq_items', None)
@@ -13,10 +14,9 @@ if using_sample != 1:
     file_name = file_name[:-4] + f'_sample{using_sample}.tsv'
 file_path = ROOT_DATA_DIR + file_name
 
-disambiguated_df = pd.read_csv(
+disambiguated_df = load_mentions(
     file_path,
-    sep='\t',
-    engine='python'
+    columns=['curation_label', 'mapped_to_software']
 )
 # for 4 possible values of 'curated_label', see unique values of 'mapped_to_software' of each type
 for label in disambiguated_df['curation_label'].unique():
@@ -1,39 +1,95 @@
+import numpy as np
 import pandas as pd
-import os
 
-def estimate_row_count(file_path, sample_size=5000):
-    file_size = os.path.getsize(file_path)
-    with open(file_path, 'rt', encoding='utf-8', errors='ignore') as file:
-        sample_data = file.read(sample_size)
-    average_row_size = sample_size / sample_data.count('\n')
-    estimated_rows = file_size / average_row_size
-    return int(estimated_rows)
+# One-pass sampler for comm_disambiguated.tsv (plain or .gz), three modes:
+#   'reservoir' - exactly num_rows rows, uniform over the whole file (Algorithm R, applied per chunk)
+#   'bernoulli' - every row kept independently with probability 1 / sample_rate
+#   'doi'       - every publication kept with probability 1 / sample_rate by hashing its doi, so a
+#                 sampled paper keeps all of its mentions and co-mention counts stay unbiased
+# Memory is one chunk plus, for 'reservoir', the num_rows sampled rows.
 
 ROOT_DATA_DIR = r'ROOTPATH'
 
 filename = ROOT_DATA_DIR + '/disambiguated/comm_disambiguated.tsv'
-num_rows = 7000000
+mode = 'doi'
+num_rows = 7000000  # reservoir size
+sample_rate = 7  # bernoulli / doi keep 1 row or publication in sample_rate
 chunksize = 500000
+seed = 1
 
-chunks = pd.read_csv(filename, sep='\t', chunksize=chunksize)
 
-estimated_rows = estimate_row_count(filename)
-print(f'Estimated number of rows: {estimated_rows}')
+def sample_path(filename, rate):
+    # comm_disambiguated.tsv(.gz) -> comm_disambiguated_sample{rate}.tsv, the name the other scripts load
+    return filename.split('.tsv')[0] + f'_sample{rate}.tsv'
 
-sample_rate = estimated_rows // num_rows
-print(f'Sample rate: {sample_rate}')
-sample_filename = filename[:-4] + f'_sample{sample_rate}.tsv'
 
-sample_frames = []
+def read_chunks(filename):
+    # read every field as text so the sample is written back unchanged
+    return pd.read_csv(filename, sep='\t', dtype=str, keep_default_na=False, chunksize=chunksize)
 
-for i, chunk in enumerate(chunks):
-    sample_frac = num_rows / (estimated_rows - i * chunksize)
-    sample = chunk.sample(frac=sample_frac, random_state=1)
-    sample_frames.append(sample)
-    num_rows -= len(sample)
-    print(f'Number of rows remaining: {num_rows}')
-    if num_rows <= 0:
-        break
 
-sample_df = pd.concat(sample_frames, ignore_index=True)
-sample_df.to_csv(sample_filename, sep='\t', index=False)
+def reservoir_sample(filename, k, rng):
+    reservoir = None
+    positions = np.empty(0, dtype=np.int64)
+    seen = 0
+
+    for chunk in read_chunks(filename):
+        chunk = chunk.reset_index(drop=True)
+        rows = np.arange(seen, seen + len(chunk))
+
+        # the first k rows fill the reservoir
+        fill = min(max(k - seen, 0), len(chunk))
+        if fill:
+            reservoir = chunk.iloc[:fill].copy() if reservoir is None else pd.concat([reservoir, chunk.iloc[:fill]], ignore_index=True)
+            positions = np.concatenate([positions, rows[:fill]])
+
+        # row i replaces slot j ~ U[0, i] when j < k; a later row wins when two pick the same slot
+        slots = rng.integers(0, rows[fill:] + 1)
+        picked = np.flatnonzero(slots < k) + fill
+        slots = slots[picked - fill]
+        last = ~pd.Series(slots).duplicated(keep='last').to_numpy()
+        slots, picked = slots[last], picked[last]
+        if len(slots):
+            reservoir.iloc[slots] = chunk.iloc[picked].to_numpy()
+            positions[slots] = rows[picked]
+
+        seen += len(chunk)
+        print(f'Rows read: {seen}')
+
+    # write the sample in file order
+    order = np.argsort(positions)
+    return reservoir.iloc[order], seen
+
+
+def stream_sample(filename, keep, output):
+    kept = 0
+    for i, chunk in enumerate(read_chunks(filename)):
+        sample = chunk[keep(chunk)]
+        sample.to_csv(output, sep='\t', index=False, mode='w' if i == 0 else 'a', header=i == 0)
+        kept += len(sample)
+        print(f'Rows kept: {kept}')
+
+
+def bernoulli_keep(rng):
+    return lambda chunk: rng.random(len(chunk)) < 1 / sample_rate
+
+
+def doi_keep(chunk):
+    # stable 64-bit hash of the doi; the seed picks a different, still reproducible, set of papers
+    hashes = pd.util.hash_pandas_object(chunk['doi'], index=False, hash_key=f'{seed:016d}').to_numpy()
+    return hashes % np.uint64(sample_rate) == 0
+
+
+rng = np.random.default_rng(seed)
+
+if mode == 'reservoir':
+    sample_df, total_rows = reservoir_sample(filename, num_rows, rng)
+    sample_rate = max(total_rows // num_rows, 1)
+    print(f'Sample rate: {sample_rate}')
+    sample_df.to_csv(sample_path(filename, sample_rate), sep='\t', index=False)
+elif mode == 'bernoulli':
+    stream_sample(filename, bernoulli_keep(rng), sample_path(filename, sample_rate))
+elif mode == 'doi':
+    stream_sample(filename, doi_keep, sample_path(filename, sample_rate))
+else:
+    raise ValueError(f'Unknown sampling mode: {mode}')
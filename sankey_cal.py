@@ -1,10 +1,23 @@
-import pandas as pd
-import json
+from functools import partial
+
+from build_aggregates import (TOTALS_FILE, YEAR_COUNTS_FILE, build_aggregates, mention_aggregates, save_pairs,
+                              write_version)
+from comention import count_pairs
+from heavy_pairs import count_heavy_hitters
+from mention_loader import clean_mentions, read_mentions, report_dropped
+from software_names import load_names
 
 # Data processing
 ROOT_DATA_DIR = r'ROOTPATH'
 
 using_sample = 1
+num_workers = 1  # > 1 counts co-mentions in a process pool
+write_json = False  # also write the old sankey_data.json
+out_of_core = False  # spill the mentions to disk and count them in groups, for files that do not fit in memory
+group_rows = 20000000  # mentions counted at once with out_of_core / heavy_hitters
+heavy_hitters = False  # keep only the pairs that can reach a top N, counted exactly in batches of publications;
+# the per-year error bounds are saved with the pairs and the views leave out the pairs they make uncertain
+heavy_hitter_error = 0.0001  # share of a year's co-mentions a pair may have and still be left out
 file_name = '/disambiguated/comm_disambiguated.tsv'
 if using_sample != 1:
     file_name = file_name[:-4] + f'_sample{using_sample}.tsv'
@@ -12,45 +25,38 @@ file_path = ROOT_DATA_DIR + file_name
 
 cols_to_load = ['doi', 'pubdate', 'software', 'curation_label', 'mapped_to_software']
 
-disambiguated_df = pd.read_csv(
-    file_path,
-    sep='\t',
-    engine='python',
-    usecols=cols_to_load)
-
-disambiguated_df = disambiguated_df[(disambiguated_df['mapped_to_software'] != 'not_disambiguated') & (disambiguated_df['curation_label'] != 'not_software')]
-disambiguated_df['year'] = disambiguated_df['pubdate'].astype(str).str[:4].astype(int, errors='ignore')
-disambiguated_df['year'] = disambiguated_df['year'].dropna().astype(int)
-
-min_year = disambiguated_df['year'].min()
-max_year = disambiguated_df['year'].max()
-
-sankey_data = {}
-
-for year in range(min_year, max_year + 1):
-    print(year)
-    year_df = disambiguated_df[disambiguated_df['year'] == year]
-    connections = {}
-    
-    for uid, group in year_df.groupby('doi'):
-        softwares = group['mapped_to_software'].unique()
-        for i in range(len(softwares)):
-            for j in range(i+1, len(softwares)):
-                software_pair = tuple(sorted((softwares[i], softwares[j])))
-                if software_pair not in connections:
-                    connections[software_pair] = 1
-                else:
-                    connections[software_pair] += 1
-    
-    connections_df = pd.DataFrame(list(connections.items()), columns=['Connection', 'Count'])
-    
-    if not connections_df.empty:
-        connections_df['Source'], connections_df['Target'] = zip(*connections_df['Connection'])
-        connections_df = connections_df.drop('Connection', axis=1)
-        sankey_data[year] = connections_df.to_dict(orient='records')
-    else:
-        sankey_data[year] = []
-
-# Save the data to a JSON file
-with open('sankey_data.json', 'w') as f:
-    json.dump(sankey_data, f)
+# the canonical software ids, extended with the names this file adds
+names = load_names()
+
+# Every mode reads the file once, and builds the year counts and the doi registry from the same mentions as the
+# pairs, so that the new version below, which starts an empty list of applied batches, matches every aggregate
+# and append_batch.py can continue from it
+if heavy_hitters:
+    count = partial(count_heavy_hitters, error=heavy_hitter_error, group_rows=group_rows)
+    year_counts, totals, (pairs, bounds) = build_aggregates(file_path, names=names, group_rows=group_rows,
+                                                            count=count)
+elif out_of_core:
+    year_counts, totals, pairs = build_aggregates(file_path, names=names, group_rows=group_rows)
+else:
+    disambiguated_df = read_mentions(file_path, columns=cols_to_load)
+    total_rows = len(disambiguated_df)
+
+    # drop not_disambiguated / not_software mentions and rows without a year
+    disambiguated_df, dropped = clean_mentions(disambiguated_df, names=names)
+    report_dropped(dropped, total_rows)
+
+    year_counts, totals = mention_aggregates(disambiguated_df, names)
+    pairs = count_pairs(disambiguated_df[['doi', 'year', 'software_id']], workers=num_workers, names=names)
+
+if year_counts.empty:
+    raise SystemExit('No mentions left after cleaning, the aggregates were not written')
+years = year_counts.index.get_level_values('year')
+min_year, max_year = int(years.min()), int(years.max())
+
+year_counts.to_csv(YEAR_COUNTS_FILE)
+totals.to_csv(TOTALS_FILE)
+
+# Save sankey_data.arrow and the cumulative pair-count index used by the quickdash apps
+names.save()
+save_pairs(pairs, min_year, max_year, write_json=write_json, bounds=bounds.to_dict() if heavy_hitters else None)
+print(f'Aggregates version {write_version([])}')
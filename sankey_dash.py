@@ -1,11 +1,14 @@
 import dash
-from dash import dcc, html
+from dash import callback, dcc, html
 from dash.dependencies import Input, Output
 import pandas as pd
+from comention import build_publication_index, publication_pairs
+from data_reload import watch_data
+from figure_cache import cached_figure, figure_cache
+from metrics import instrumented, register, stage
+from mention_store import load_mentions, store_version
 import plotly.graph_objects as go
 
-app = dash.Dash(__name__)
-
 # data processing
 ROOT_DATA_DIR = r'ROOTPATH'
 
@@ -14,57 +17,35 @@ file_path = ROOT_DATA_DIR + '/disambiguated/comm_disambiguated.tsv'
 if using_sample:
     file_path = file_path[:-4] + '_sample.tsv'
 
-disambiguated_df = pd.read_csv(
-    file_path,
-    sep='\t',
-    engine='python',
-    # compression='gzip',
-    # nrows=2000000
-)
+def load_publication_index():
+    disambiguated_df = load_mentions(
+        file_path,
+        columns=['doi', 'year', 'mapped_to_software', 'curation_label']
+    )
 
-# filter ['mapped_to_software'] != 'not_disambiguated' and ['curation_label'] != 'not_software'
-disambiguated_df = disambiguated_df[disambiguated_df['mapped_to_software'] != 'not_disambiguated']
-disambiguated_df = disambiguated_df[disambiguated_df['curation_label'] != 'not_software']
+    # filter ['mapped_to_software'] != 'not_disambiguated' and ['curation_label'] != 'not_software'
+    disambiguated_df = disambiguated_df[disambiguated_df['mapped_to_software'] != 'not_disambiguated']
+    disambiguated_df = disambiguated_df[disambiguated_df['curation_label'] != 'not_software']
 
-disambiguated_df['year'] = disambiguated_df['pubdate'].astype(str).str[:4].astype(int, errors='ignore')
-disambiguated_df['year'] = disambiguated_df['year'].dropna().astype(int)
+    # Index the software mentioned by every publication once; callbacks count the pairs of any year range from it
+    return build_publication_index(disambiguated_df)
 
-min_year = disambiguated_df['year'].min()
-max_year = disambiguated_df['year'].max()
+# rebuilt, and the cached figures dropped, whenever mention_store.py rebuilds the store
+publication_data = watch_data('publication_index', load_publication_index, lambda: store_version(file_path))
+publication_data.subscribe(lambda: figure_cache.clear('sankey_dash'))
 
-# Function to create the Sankey diagram
-def create_sankey(df, selected_N):
-    # Calculate the connections between software mentions
-    connections = {}
-    for uid, group in df.groupby('doi'):
-        softwares = group['mapped_to_software'].unique()
-        for i in range(len(softwares)):
-            for j in range(i+1, len(softwares)):
-                # Ensure the smaller software name comes first in the tuple
-                software_pair = tuple(sorted((softwares[i], softwares[j])))
-                if software_pair not in connections:
-                    connections[software_pair] = 1
-                else:
-                    connections[software_pair] += 1
+publication_years = publication_data.get()['year']
+min_year = int(publication_years.min()) if len(publication_years) else 0
+max_year = int(publication_years.max()) if len(publication_years) else 0
 
-    # Convert connections to a DataFrame
-    connections_df = pd.DataFrame(list(connections.items()), columns=['Connection', 'Count'])
-    connections_df[['Source', 'Target']] = pd.DataFrame(connections_df['Connection'].tolist(), index=connections_df.index)
-    connections_df = connections_df.drop('Connection', axis=1)
-    
+# Function to create the Sankey diagram
+def create_sankey(connections_df, selected_N):
     # Select the top N connections
     top_connections = connections_df.nlargest(selected_N, 'Count')
     
-    # Create the nodes for the Sankey diagram
-    all_software = pd.concat([top_connections['Source'], top_connections['Target']]).unique()
-    nodes = [{'name': software} for software in all_software]
-    
-    # Create the links for the Sankey diagram
-    links = []
-    for index, row in top_connections.iterrows():
-        source_index = list(all_software).index(row['Source'])
-        target_index = list(all_software).index(row['Target'])
-        links.append({'source': source_index, 'target': target_index, 'value': row['Count']})
+    # Index the nodes in order of first appearance, sources first
+    codes, all_software = pd.factorize(pd.concat([top_connections['Source'], top_connections['Target']]))
+    link_source, link_target = codes[:len(top_connections)], codes[len(top_connections):]
     
     # Create the Sankey diagram
     sankey_figure = go.Figure(go.Sankey(
@@ -72,35 +53,39 @@ def create_sankey(df, selected_N):
             pad=15,
             thickness=20,
             line=dict(color='black', width=0.5),
-            label=[node['name'] for node in nodes]
+            label=all_software.to_numpy()
         ),
         link=dict(
-            source=[link['source'] for link in links],
-            target=[link['target'] for link in links],
-            value=[link['value'] for link in links]
+            source=link_source,
+            target=link_target,
+            value=top_connections['Count'].to_numpy()
         )
     ))
 
     sankey_figure.update_layout(title_text="Software Mentions Connections", font_size=10)
     return sankey_figure
 
-@app.callback(
-    Output('software-connections', 'figure'),
-    [Input('n-selector', 'value'),
-     Input('year-slider', 'value')]
+@callback(
+    Output('comention-software-connections', 'figure'),
+    [Input('comention-n-selector', 'value'),
+     Input('comention-year-slider', 'value')]
 )
+@instrumented('sankey_dash')
+@cached_figure('sankey_dash', version=publication_data.version)
 def update_graph(selected_N, year_range):
-    # Filter data based on the selected year range
-    df_filtered = disambiguated_df[(disambiguated_df['year'] >= year_range[0]) & (disambiguated_df['year'] <= year_range[1])]
-    return create_sankey(df_filtered, selected_N)
+    # Calculate the connections between software mentions in the selected year range
+    with stage('sankey_dash', 'publication_pairs'):
+        connections_df = publication_pairs(publication_data.get(), year_range)
+    with stage('sankey_dash', 'create_sankey'):
+        return create_sankey(connections_df, selected_N)
 
 # Dash app layout
-app.layout = html.Div([
+layout = html.Div([
     html.Div([
         html.Div([
             html.H6('N Most Cited Software:', style={'marginBottom': 5, 'marginTop': 0}),
             dcc.Dropdown(
-                id='n-selector',
+                id='comention-n-selector',
                 options=[
                     {'label': 'Top 5', 'value': 5},
                     {'label': 'Top 10', 'value': 10},
@@ -115,7 +100,7 @@ app.layout = html.Div([
 
     html.Div([
         dcc.RangeSlider(
-            id='year-slider',
+            id='comention-year-slider',
             min=1970,
             max=2021,
             step=1,
@@ -125,10 +110,13 @@ app.layout = html.Div([
     ], style={'padding': '10px', 'boxShadow': '0px 0px 5px #ccc', 'borderRadius': '5px', 'marginBottom': '20px'}),
 
     dcc.Graph(
-        id='software-connections',
+        id='comention-software-connections',
         style={'height': '70vh'}  # Set the height of the graph
     ),
 ], style={'padding': '10px', 'height': '100vh', 'margin': '0'})
 
 if __name__ == '__main__':
-    app.run_server(debug=False, port=8051)
+    app = dash.Dash(__name__)
+    app.layout = layout
+    register(app.server)
+    app.run_server(debug=False, port=8053)
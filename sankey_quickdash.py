@@ -1,18 +1,25 @@
 import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash import callback, clientside_callback, dcc, html
+from dash.dependencies import Input, Output, State
 import pandas as pd
 import plotly.graph_objects as go
-import json
+from animation import AnimationBuilder, animation_figure, autoplay_script
+from build_aggregates import aggregates_version
+from data_reload import watch_data
+from figure_cache import cached_figure, figure_cache
+from metrics import instrumented, register, stage
+from pair_index import load_pair_index, range_bound, top_pairs
+from payload import fit_budget
 
-app = dash.Dash(__name__)
+# Read the precomputed cumulative pair counts, built from sankey_data.arrow if sankey_cal.py did not write them,
+# and swap in the new ones whenever build_aggregates.py or append_batch.py writes a new version
+pair_data = watch_data('pair_index', lambda: load_pair_index('sankey_index', 'sankey_data.arrow'),
+                       lambda: aggregates_version('sankey_index', 'sankey_data.arrow'))
 
-# Read the precomputed Sankey data
-with open('sankey_data.json', 'r') as f:
-    sankey_data = json.load(f)
+min_year, max_year = (int(year) for year in pair_data.get()['years'])
 
-min_year = min(map(int, sankey_data.keys()))
-max_year = max(map(int, sankey_data.keys()))
+PAYLOAD_BUDGET = None  # bytes per figure, e.g. 200000: rounded link values, fewer links if over
+PREBUILD_ANIMATION = False  # build the animation of every selection in the background, so Play starts at once
 
 # Function to create the Sankey diagram
 def create_sankey(connections_df, selected_N):
@@ -24,56 +31,101 @@ def create_sankey(connections_df, selected_N):
     
     top_connections = connections_df.nlargest(selected_N, 'Count')
     
-    all_software = pd.concat([top_connections['Source'], top_connections['Target']]).unique()
-    nodes = [{'name': software} for software in all_software]
-    
-    links = []
-    for index, row in top_connections.iterrows():
-        source_index = list(all_software).index(row['Source'])
-        target_index = list(all_software).index(row['Target'])
-        links.append({'source': source_index, 'target': target_index, 'value': row['Count']})
+    codes, all_software = pd.factorize(pd.concat([top_connections['Source'], top_connections['Target']]))
+    link_source, link_target = codes[:len(top_connections)], codes[len(top_connections):]
     
     sankey_figure = go.Figure(go.Sankey(
         node=dict(
             pad=15,
             thickness=20,
             line=dict(color='black', width=0.5),
-            label=[node['name'] for node in nodes]
+            label=all_software.to_numpy()
         ),
         link=dict(
-            source=[link['source'] for link in links],
-            target=[link['target'] for link in links],
-            value=[link['value'] for link in links]
+            source=link_source,
+            target=link_target,
+            value=top_connections['Count'].to_numpy()
         )
     ))
 
     sankey_figure.update_layout(title_text="Software Mentions Connections", font_size=10)
     return sankey_figure
 
-@app.callback(
-    Output('software-connections', 'figure'),
-    [Input('n-selector', 'value'),
-     Input('year-slider', 'value')]
+@cached_figure('sankey', version=pair_data.version)
+def sankey_figure(selected_N, year_range):
+    index = pair_data.get()
+    with stage('sankey', 'top_pairs'):
+        combined_connections = top_pairs(index, year_range, selected_N)
+    if PAYLOAD_BUDGET is None:
+        with stage('sankey', 'create_sankey'):
+            figure = create_sankey(combined_connections, selected_N)
+    else:
+        # the heaviest connections that fit the budget, see payload.py
+        n_shown = min(selected_N, len(combined_connections))
+        with stage('sankey', 'fit_budget'):
+            figure, n_links, _ = fit_budget(lambda n: create_sankey(combined_connections, n), n_shown,
+                                            PAYLOAD_BUDGET)
+        if n_links < n_shown:
+            figure['layout']['title']['text'] += f' (top {n_links} of {n_shown} connections)'
+    bound = range_bound(index, year_range)
+    if bound:
+        figure['layout']['title']['text'] += f' (approximate: connections of {bound} or fewer not shown)'
+    return figure
+
+def build_animation(selected_N, year_range):
+    # one frame per end year, from the selected range to the last year
+    end_years = range(year_range[1], int(pair_data.get()['years'][1]) + 1)
+    figures = [sankey_figure(selected_N, [year_range[0], end_year]) for end_year in end_years]
+    with stage('sankey', 'animation_figure'):
+        return animation_figure(figures, end_years, redraw=True)
+
+animations = AnimationBuilder(build_animation)
+
+def reset_caches():
+    # figures and animations of the previous data version are never requested again
+    figure_cache.clear('sankey')
+    animations.clear()
+
+pair_data.subscribe(reset_caches)
+
+@callback(
+    Output('sankey-software-connections', 'figure'),
+    [Input('sankey-n-selector', 'value'),
+     Input('sankey-year-slider', 'value')]
 )
+@instrumented('sankey')
 def update_graph(selected_N, year_range):
-    combined_connections = pd.DataFrame(columns=['Source', 'Target', 'Count'])
-    
-    for year in range(year_range[0], year_range[1] + 1):
-        year_str = str(year)
-        if year_str in sankey_data:
-            year_connections = pd.DataFrame(sankey_data[year_str])
-            combined_connections = pd.concat([combined_connections, year_connections])
-    
-    combined_connections = combined_connections.groupby(['Source', 'Target'], as_index=False).sum()
-    return create_sankey(combined_connections, selected_N)
+    if PREBUILD_ANIMATION:
+        # start building the animation for this selection in the background
+        animations.submit(selected_N, tuple(year_range))
+    return sankey_figure(selected_N, year_range)
+
+# Play builds every frame, unless PREBUILD_ANIMATION already did, and sends them to the browser at once,
+# playback needs no server round trips
+@callback(
+    Output('sankey-software-connections', 'figure', allow_duplicate=True),
+    Input('sankey-play-button', 'n_clicks'),
+    State('sankey-n-selector', 'value'),
+    State('sankey-year-slider', 'value'),
+    prevent_initial_call=True,
+)
+@instrumented('sankey')
+def play_animation(n_clicks, selected_N, year_range):
+    return animations.get(selected_N, tuple(year_range))
+
+clientside_callback(
+    autoplay_script('sankey-software-connections', redraw=True),
+    Output('sankey-animation-frames', 'data'),
+    Input('sankey-software-connections', 'figure'),
+)
 
 # Dash app layout
-app.layout = html.Div([
+layout = html.Div([
     html.Div([
         html.Div([
             html.H6('N Most Cited Software:', style={'marginBottom': 5, 'marginTop': 0}),
             dcc.Dropdown(
-                id='n-selector',
+                id='sankey-n-selector',
                 options=[
                     {'label': 'Top 5', 'value': 5},
                     {'label': 'Top 10', 'value': 10},
@@ -89,21 +141,27 @@ app.layout = html.Div([
 
     html.Div([
         dcc.RangeSlider(
-            id='year-slider',
+            id='sankey-year-slider',
             min=1990,
-            max=2021,
+            max=max_year,
             step=1,
-            marks={i: str(i) for i in range(1990, 2021 + 1, 5)},
+            marks={i: str(i) for i in range(1990, max_year + 1, 5)},
             value=[1995, max_year]  # default value
         )
     ], style={'padding': '10px', 'boxShadow': '0px 0px 5px #ccc', 'borderRadius': '5px', 'marginBottom': '20px'}),
 
+    html.Button('Play', id='sankey-play-button', n_clicks=0),
+    dcc.Store(id='sankey-animation-frames'),
+
     dcc.Graph(
-        id='software-connections',
+        id='sankey-software-connections',
         style={'height': '70vh'}  # Set the height of the graph
     ),
 ], style={'padding': '10px', 'height': '100vh', 'margin': '0'})
 
 
 if __name__ == '__main__':
+    app = dash.Dash(__name__)
+    app.layout = layout
+    register(app.server)
     app.run_server(debug=False, port=8051)
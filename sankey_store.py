@@ -0,0 +1,105 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Binary replacement for sankey_data.json: one Arrow IPC file with int16 year and int32 count columns sorted by
+# year, and source/target as int32 codes dictionary-encoded against the sorted software name table.
+# Pairs counted with heavy_hitters (heavy_pairs.py) keep the per-year undercount bound in the schema metadata.
+# The file is memory mapped, so the arrays and the name table are zero-copy views on the page cache that every
+# worker shares; names are only decoded for the codes that are looked up (take_names).
+#
+# Convert an existing JSON file with: python sankey_store.py sankey_data.json sankey_data.arrow
+
+SANKEY_FILE = 'sankey_data.arrow'
+
+
+def encode_names(pairs):
+    # int32 Source/Target codes into the sorted names of both columns, as an Arrow string array
+    codes, names = pd.factorize(pd.concat([pairs['Source'], pairs['Target']], ignore_index=True), sort=True)
+    codes = codes.astype(np.int32)
+    return codes[:len(pairs)], codes[len(pairs):], pa.array(names.to_numpy(), type=pa.string())
+
+
+def write_sankey_file(path, pairs, min_year, max_year, bounds=None):
+    # pairs has year/Count/Source/Target columns, as returned by comention.count_pairs; bounds maps year to the
+    # most co-mentions a pair left out of an approximate count can have in that year
+    pairs = pairs.sort_values('year', kind='stable')
+    source, target, names = encode_names(pairs)
+
+    table = pa.table({
+        'year': pa.array(pairs['year'].to_numpy(), type=pa.int16()),
+        'source': pa.DictionaryArray.from_arrays(source, names),
+        'target': pa.DictionaryArray.from_arrays(target, names),
+        'count': pa.array(pairs['Count'].to_numpy(), type=pa.int32()),
+    })
+    table = table.replace_schema_metadata({
+        'years': json.dumps([int(min_year), int(max_year)]),
+        'bounds': json.dumps({int(year): int(bound) for year, bound in (bounds or {}).items() if bound}),
+    })
+
+    # write a new file and rename it over the old one, which stays valid for readers that mapped it
+    with pa.OSFile(path + '.tmp', 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(len(table), 1))
+    os.replace(path + '.tmp', path)
+
+
+def read_sankey_file(path):
+    # single-chunk columns convert to read-only numpy views on the mapped file
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    metadata = table.schema.metadata
+    data = {column: single_chunk(table, column) for column in ['year', 'source', 'target', 'count']}
+    if pa.types.is_dictionary(data['source'].type):
+        data['names'] = data['source'].dictionary
+        data['source'], data['target'] = data['source'].indices, data['target'].indices
+    else:
+        # files written before the names were dictionary-encoded keep them in the metadata
+        data['names'] = pa.array(json.loads(metadata[b'names']), type=pa.string())
+    data.update({column: data[column].to_numpy() for column in ['year', 'source', 'target', 'count']})
+    data['years'] = json.loads(metadata[b'years'])
+    data['bounds'] = {int(year): bound for year, bound in json.loads(metadata.get(b'bounds', b'{}')).items()}
+    return data
+
+
+def single_chunk(table, column):
+    column = table.column(column)
+    return column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+
+
+def take_names(names, codes):
+    # the names of the codes as an object array, without converting the whole name table
+    return names.take(pa.array(np.asarray(codes))).to_numpy(zero_copy_only=False)
+
+
+def year_connections(data, year):
+    # the Source/Target/Count records sankey_data.json holds for one year
+    start, end = np.searchsorted(data['year'], [year, year + 1])
+    return pd.DataFrame({
+        'Source': take_names(data['names'], data['source'][start:end]),
+        'Target': take_names(data['names'], data['target'][start:end]),
+        'Count': data['count'][start:end],
+    })
+
+
+def read_sankey_json(json_path):
+    with open(json_path, 'r') as f:
+        sankey_data = json.load(f)
+    years = list(map(int, sankey_data.keys()))
+    pairs = pd.DataFrame([dict(record, year=int(year)) for year, year_records in sankey_data.items()
+                          for record in year_records], columns=['year', 'Count', 'Source', 'Target'])
+    return pairs, min(years), max(years)
+
+
+def json_to_sankey_file(json_path, path):
+    write_sankey_file(path, *read_sankey_json(json_path))
+
+
+if __name__ == '__main__':
+    json_path = sys.argv[1] if len(sys.argv) > 1 else 'sankey_data.json'
+    path = sys.argv[2] if len(sys.argv) > 2 else SANKEY_FILE
+    json_to_sankey_file(json_path, path)
+    print(f'{json_path} converted to {path}')
@@ -0,0 +1,107 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Canonical software names with stable integer ids, shared by every script that cleans mentions
+# (mention_loader.clean_mentions with names=...). A name's id is its row in software_names.parquet, written next to
+# the other aggregates; ids are only ever appended, so the doi registry and later batches keep meaning the same
+# software. Grouping, joining and pair counting run on the int32 software_id column, and names are decoded
+# when results are written or drawn.
+#
+# Raw software strings of not_disambiguated mentions are matched by a normalized key instead of exactly:
+# casefolded, without a trailing version ('SPSS 22.0', 'ImageJ v1.52a', 'Python3.7') and with single spaces.
+# Only dotted versions and numbers marked with v/version count as versions: a bare trailing number is often
+# part of the name ('Windows 10', 'Office 365', 'GPT-4', 'Python 2' and 'Python 3' stay apart).
+# A raw name whose key is already known gets that id; otherwise its first spelling becomes a new name.
+
+NAMES_FILE = 'software_names.parquet'
+# a version marked with v/version after a separator, or a dotted version
+VERSION_SUFFIX = re.compile(r'(?:[\s_-]+v(?:ersion)?\.?\s*\d+(?:\.\d+)*|[\s_-]*(?<![\d.])\d+(?:\.\d+)+)[a-z]?$')
+
+
+def normalize_name(name):
+    key = ' '.join(name.casefold().split())
+    return VERSION_SUFFIX.sub('', key).strip() or key
+
+
+class SoftwareNames:
+    def __init__(self, names=(), keys=None):
+        self.names = list(names)
+        self.keys = list(keys) if keys is not None else [normalize_name(name) for name in self.names]
+        self.name_ids = {name: i for i, name in enumerate(self.names)}
+        self.key_ids = {}
+        for i, key in enumerate(self.keys):
+            self.key_ids.setdefault(key, i)
+        self.array = None
+        self.rank = None
+        self.sorted_names = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        if name not in self.name_ids:
+            key = normalize_name(name)
+            self.name_ids[name] = len(self.names)
+            self.key_ids.setdefault(key, len(self.names))
+            self.names.append(name)
+            self.keys.append(key)
+        return self.name_ids[name]
+
+    def add_raw(self, name):
+        # an unmapped software string: the id of a known name with the same key, or a new name
+        if name in self.name_ids:
+            return self.name_ids[name]
+        key = normalize_name(name)
+        return self.key_ids[key] if key in self.key_ids else self.add(name)
+
+    def encode(self, values, raw=False):
+        # int32 ids of the values, -1 for missing ones; only the distinct values of the chunk are looked up
+        local_codes, uniques = pd.factorize(values)
+        add = self.add_raw if raw else self.add
+        lookup = np.array([add(value) for value in uniques] + [-1], dtype=np.int32)
+        return lookup[local_codes]
+
+    def name_array(self):
+        if self.array is None or len(self.array) != len(self.names):
+            self.array = np.array(self.names, dtype=object)
+        return self.array
+
+    def decode(self, ids):
+        # names of the ids, None for -1
+        ids = np.asarray(ids, dtype=np.int64)
+        decoded = np.full(ids.shape, None, dtype=object)
+        known = ids >= 0
+        decoded[known] = self.name_array()[ids[known]]
+        return decoded
+
+    def sorted_codes(self, ids):
+        # the ids as codes into the names in sorted order, -1 kept, like pd.factorize(names, sort=True)
+        # names are only appended, so the ranking is redone only when the table grew
+        names = self.name_array()
+        if self.rank is None or len(self.rank) != len(names) + 1:
+            order = np.argsort(names, kind='stable')
+            self.rank = np.empty(len(order) + 1, dtype=np.int64)
+            self.rank[order] = np.arange(len(order))
+            self.rank[-1] = -1
+            self.sorted_names = names[order]
+        return self.rank[np.asarray(ids)], self.sorted_names
+
+    def save(self, path=NAMES_FILE):
+        table = pa.table({'id': pa.array(np.arange(len(self.names)), type=pa.int32()),
+                          'name': pa.array(self.names, type=pa.string()),
+                          'key': pa.array(self.keys, type=pa.string())})
+        pq.write_table(table, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+
+def load_names(path=NAMES_FILE):
+    # the persisted table, or an empty one before the first build
+    if not os.path.exists(path):
+        return SoftwareNames()
+    table = pq.read_table(path).sort_by('id')
+    return SoftwareNames(table['name'].to_pylist(), table['key'].to_pylist())
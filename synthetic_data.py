@@ -0,0 +1,115 @@
+import argparse
+import gzip
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv
+
+# Synthetic comm_disambiguated.tsv with the same columns as the real dump, for benchmarks without the dataset.
+#   software popularity  - Zipf law over n_software names
+#   mentions per doi     - geometric, poisson or constant with the given mean; mentions are listed
+#                          publication by publication, like the real dump
+#   year skew            - publication counts grow by year_growth per year
+#   noise                - shares of not_disambiguated and not_software rows
+# The file is written in chunks with pyarrow's CSV writer, so 10^8 rows need no more memory than 10^5.
+#
+# python synthetic_data.py 1e6 comm_disambiguated.tsv.gz --zipf-exponent 1.2 --mean-mentions 6
+
+COLUMNS = ['license', 'location', 'pmcid', 'pmid', 'doi', 'pubdate', 'source', 'number', 'text', 'software',
+           'version', 'ID', 'curation_label', 'mapped_to_software']
+OTHER_LABELS = {'unclear': 0.05, 'creation': 0.05}
+GZIP_LEVEL = 1
+
+DEFAULTS = {
+    'n_software': 20000,
+    'zipf_exponent': 1.1,
+    'mentions_distribution': 'geometric',
+    'mean_mentions': 4.0,
+    'first_year': 1990,
+    'last_year': 2021,
+    'year_growth': 0.12,
+    'not_disambiguated_share': 0.1,
+    'not_software_share': 0.1,
+}
+
+
+def mentions_per_doi(rng, n, distribution, mean):
+    if distribution == 'geometric':
+        return rng.geometric(1 / mean, n)
+    if distribution == 'poisson':
+        return 1 + rng.poisson(mean - 1, n)
+    if distribution == 'constant':
+        return np.full(n, max(round(mean), 1))
+    raise ValueError(f'Unknown mentions-per-doi distribution: {distribution}')
+
+
+def synthetic_chunk(rng, rows, first_row, first_doi, options):
+    # draw publications until they hold rows mentions; the last one is cut at the chunk end
+    sizes = mentions_per_doi(rng, int(rows / options['mean_mentions']) + 16, options['mentions_distribution'],
+                             options['mean_mentions'])
+    while sizes.sum() < rows:
+        sizes = np.concatenate([sizes, mentions_per_doi(rng, len(sizes), options['mentions_distribution'],
+                                                        options['mean_mentions'])])
+    n_doi = np.searchsorted(np.cumsum(sizes), rows) + 1
+    doi = first_doi + np.repeat(np.arange(n_doi), sizes[:n_doi])[:rows]
+
+    years = np.arange(options['first_year'], options['last_year'] + 1)
+    year_weights = np.exp(options['year_growth'] * (years - years[0]))
+    doi_year = rng.choice(len(years), n_doi, p=year_weights / year_weights.sum())
+
+    popularity = 1 / np.arange(1, options['n_software'] + 1) ** options['zipf_exponent']
+    software = rng.choice(options['n_software'], rows, p=popularity / popularity.sum())
+    # mapped_to_software uses one more category, not_disambiguated
+    mapped = np.where(rng.random(rows) < options['not_disambiguated_share'], options['n_software'], software)
+    names = np.char.add('software_', np.arange(options['n_software']).astype(str)).tolist()
+
+    labels = ['software', 'not_software'] + list(OTHER_LABELS)
+    shares = [1 - options['not_software_share'] - sum(OTHER_LABELS.values()), options['not_software_share']]
+    shares += list(OTHER_LABELS.values())
+
+    # string columns are categoricals over their distinct values, so a chunk stays small in memory
+    dois = np.arange(first_doi, first_doi + n_doi).astype(str)
+    publication = doi - first_doi
+    chunk = pd.DataFrame({
+        'license': 'cc-by',
+        'location': 'methods',
+        'pmcid': pd.Categorical.from_codes(publication, np.char.add('PMC', dois)),
+        'pmid': doi,
+        'doi': pd.Categorical.from_codes(publication, np.char.add('10.1000/', dois)),
+        'pubdate': pd.Categorical.from_codes(doi_year[publication], np.char.add(years.astype(str), '-01-01')),
+        'source': 'comm',
+        'number': 1,
+        'text': 'analysed with the software',
+        'software': pd.Categorical.from_codes(software, names),
+        'version': '1.0',
+        'ID': np.arange(first_row, first_row + rows),
+        'curation_label': pd.Categorical.from_codes(rng.choice(len(labels), rows, p=shares), labels),
+        'mapped_to_software': pd.Categorical.from_codes(mapped, names + ['not_disambiguated']),
+    }, columns=COLUMNS)
+    return chunk, first_doi + n_doi
+
+
+def write_synthetic(path, rows, seed=0, chunksize=1000000, **options):
+    options = dict(DEFAULTS, **options)
+    rng = np.random.default_rng(seed)
+    write_options = csv.WriteOptions(delimiter='\t', quoting_style='none', include_header=False)
+    first_doi = 0
+    with (gzip.open(path, 'wb', compresslevel=GZIP_LEVEL) if path.endswith('.gz') else open(path, 'wb')) as f:
+        f.write(('\t'.join(COLUMNS) + '\n').encode())
+        for first_row in range(0, rows, chunksize):
+            chunk, first_doi = synthetic_chunk(rng, min(chunksize, rows - first_row), first_row, first_doi, options)
+            csv.write_csv(pa.Table.from_pandas(chunk, preserve_index=False), f, write_options=write_options)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic comm_disambiguated.tsv')
+    parser.add_argument('rows', type=float, help='number of mentions, e.g. 1e6')
+    parser.add_argument('path', nargs='?', default='comm_disambiguated.tsv')
+    parser.add_argument('--seed', type=int, default=0)
+    for name, default in DEFAULTS.items():
+        parser.add_argument('--' + name.replace('_', '-'), type=type(default), default=default)
+    args = vars(parser.parse_args())
+    rows, path = int(args.pop('rows')), args.pop('path')
+    print(f'{rows} rows written to {write_synthetic(path, rows, **args)}')
@@ -0,0 +1,45 @@
+import gc
+import importlib
+
+import dash
+from dash import dcc, html
+from metrics import register
+
+# All the views as pages of one Dash app, so the datasets are loaded once per process instead of once per app.
+# The view modules load their data when imported and register their callbacks with dash.callback under
+# prefixed ids; the two pair-index views share one memory-mapped index and its reloads (data_reload.py).
+#
+# Under a pre-forking WSGI server the data is loaded in the master and the workers share it copy-on-write:
+#   gunicorn --preload --workers 4 --bind 0.0.0.0:8050 viz_server:server
+# or, single process:
+#   python viz_server.py
+# Callback timings are served on /metrics to requests from the server itself, see metrics.py.
+
+# (module, path, name); sankey_dash loads the row-level mentions, drop it to serve only the precomputed views
+VIEWS = [
+    ('area_dash', '/', 'Software trends'),
+    ('sankey_quickdash', '/sankey', 'Co-mentions'),
+    ('network_quickdash', '/network', 'Co-mention network'),
+    ('sankey_dash', '/sankey-mentions', 'Co-mentions from mentions'),
+]
+
+app = dash.Dash(__name__, use_pages=True, pages_folder='')
+
+for module_name, path, name in VIEWS:
+    module = importlib.import_module(module_name)
+    dash.register_page(module_name, path=path, name=name, layout=module.layout)
+
+app.layout = html.Div([
+    html.Div([dcc.Link(page['name'], href=page['relative_path'], style={'marginRight': '20px'})
+              for page in dash.page_registry.values()], style={'padding': '10px'}),
+    dash.page_container,
+])
+
+server = register(app.server)
+
+# Everything loaded so far is read-only from here on: move it out of the garbage collector's reach,
+# so collections in the forked workers do not write to (and copy) the shared pages
+gc.freeze()
+
+if __name__ == '__main__':
+    app.run_server(debug=False, port=8050)